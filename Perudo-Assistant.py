@@ -1,24 +1,180 @@
+import atexit
+import os
 import tkinter as tk
 from tkinter import ttk
 
-def binomial_coefficient(n, k):
-    if k < 0 or k > n:
-        return 0
-    if k == 0 or k == n:
-        return 1
-    k = min(k, n - k)
-    c = 1
-    for i in range(k):
-        c = c * (n - i) // (i + 1)
-    return c
+from perudo_decision import DUDO, analyse_table, describe_action
+from perudo_endgame import DEFAULT_TABLE_PATH, EndgameSolver
+from perudo_engine import prewarm_tail_tables
+from perudo_inference import BidHistory
+from perudo_metrics import ENABLED as PROFILING, OVERLAY as PROFILE_OVERLAY, count_widgets, metrics, timed
+from perudo_recording import RECORD_ENV_VAR, SessionRecorder
+from perudo_rules import STANDARD, VARIANTS
+from perudo_stats import OpponentStats
+from perudo_state import GameState, evaluate_state
+from perudo_worker import BackgroundWorker
 
-def calculate_binomial_probability(n, p, k):
-    return binomial_coefficient(n, k) * (p ** k) * ((1 - p) ** (n - k))
+HEATMAP_CELL_WIDTH = 34
+HEATMAP_CELL_HEIGHT = 22
+HEATMAP_LABEL_WIDTH = 30
+RECOMMENDATION_COUNT = 5
+# The biggest table the GUI allows: 10 opponents with 10 dice, and your 5
+PREWARM_DICE = 105
+PROFILE_REFRESH_MS = 500
+
+# PERUDO_PROFILE=1 (or =overlay), see perudo_metrics.py
+if PROFILING:
+    count_widgets(tk.BaseWidget)
+    atexit.register(metrics.dump)
+
+def heatmap_color(prob):
+    # Red at 0%, yellow at 50%, green at 100%
+    if prob < 0.5:
+        red, green = 255, int(510 * prob)
+    else:
+        red, green = int(510 * (1 - prob)), 255
+    return f"#{red:02x}{green:02x}60"
+
+class RecalculationScheduler:
+    # Collects input changes and runs one recalculation when Tk goes idle
+    def __init__(self, root, callback):
+        self.root = root
+        self.callback = callback
+        self.dirty = set()
+        self.pending = None
+        self.compute_count = 0
+    
+    def watch(self, var, reason):
+        return var.trace_add("write", lambda *args: self.mark_dirty(reason))
+    
+    def mark_dirty(self, reason):
+        self.dirty.add(reason)
+        if self.pending is None:
+            self.pending = self.root.after_idle(self.flush)
+    
+    def flush(self):
+        if self.pending is not None:
+            self.root.after_cancel(self.pending)
+            self.pending = None
+        if not self.dirty:
+            return
+        changed = self.dirty
+        self.dirty = set()
+        self.compute_count += 1
+        self.callback(changed)
+
+class OpponentRow:
+    # Widgets and variables for one opponent, kept so the panel can update in place
+    def __init__(self, parent, index, calculator):
+        self.dice_var = tk.IntVar(value=5)
+        # Stats are kept per name, so the same player can sit anywhere
+        self.name_var = tk.StringVar(value=f"P{index+1}")
+        self.suspected_vars = []
+        self.confidence_vars = []
+        self.suspected_labels = []
+        
+        self.container = ttk.Frame(parent)
+        self.container.pack(side=tk.LEFT, padx=5)
+        
+        opp_row = ttk.Frame(self.container)
+        opp_row.pack()
+        
+        ttk.Label(opp_row, text=f"P{index+1}:").pack(side=tk.LEFT)
+        ttk.Entry(opp_row, textvariable=self.name_var, width=8).pack(side=tk.LEFT, padx=(0, 5))
+        spin = ttk.Spinbox(opp_row, from_=1, to=10, textvariable=self.dice_var, 
+                          width=3)
+        spin.pack(side=tk.LEFT, padx=(0, 10))
+        
+        suspected_frame = ttk.Frame(self.container)
+        suspected_frame.pack(fill=tk.X, pady=(2, 0))
+        
+        ttk.Label(suspected_frame, text="Suspected:").pack(side=tk.LEFT)
+        
+        self.suspected_dice_frame = ttk.Frame(suspected_frame)
+        self.suspected_dice_frame.pack(side=tk.LEFT, padx=5)
+        
+        # Button frame for suspected actions
+        button_frame = ttk.Frame(self.container)
+        button_frame.pack(fill=tk.X, pady=(5, 0))
+        
+        ttk.Button(button_frame, text="Set Suspected", 
+                  command=lambda: calculator.set_suspected_dice(index)).pack(side=tk.LEFT, padx=2)
+        
+        # Clear suspicion button
+        ttk.Button(button_frame, text="Clear", 
+                  command=lambda: calculator.clear_suspected_dice(index)).pack(side=tk.LEFT, padx=2)
+    
+    def resize_suspected(self, dice_count):
+        if len(self.suspected_vars) < dice_count:
+            for _ in range(dice_count - len(self.suspected_vars)):
+                self.suspected_vars.append(tk.StringVar(value=""))
+                self.confidence_vars.append(tk.IntVar(value=100))
+        elif len(self.suspected_vars) > dice_count:
+            del self.suspected_vars[dice_count:]
+            del self.confidence_vars[dice_count:]
+    
+    def clear_suspected(self):
+        self.suspected_vars.clear()
+        self.confidence_vars.clear()
+    
+    def confidence(self, i):
+        # Blank or mistyped confidence counts as certain
+        try:
+            value = self.confidence_vars[i].get()
+        except tk.TclError:
+            return 1.0
+        return min(max(value, 0), 100) / 100
+    
+    def suspected_dice(self):
+        # Certain dice as faces, less certain ones as (face, confidence)
+        dice = []
+        for i, var in enumerate(self.suspected_vars[:self.dice_var.get()]):
+            value = var.get()
+            if value == "":
+                continue
+            confidence = self.confidence(i)
+            dice.append(int(value) if confidence >= 1.0 else (int(value), confidence))
+        return dice
+    
+    def update_suspected_display(self):
+        faces = [(var.get(), self.confidence(i)) for i, var in enumerate(self.suspected_vars)]
+        faces = [(face, confidence) for face, confidence in faces if face]
+        
+        for _ in faces[len(self.suspected_labels):]:
+            label = ttk.Label(self.suspected_dice_frame, 
+                            relief="solid", width=2, padding=2)
+            label.pack(side=tk.LEFT, padx=2)
+            self.suspected_labels.append(label)
+        for label, (face, confidence) in zip(self.suspected_labels, faces):
+            # Less certain dice are shown greyed out
+            label.config(text=face, background="light yellow" if confidence >= 1.0 else "light grey")
+        for label in self.suspected_labels[len(faces):]:
+            label.destroy()
+        del self.suspected_labels[len(faces):]
+    
+    def destroy(self):
+        self.container.destroy()
 
 class PerudoCalculator:
     def __init__(self, root):
         self.root = root
         self.root.title("Perudo Assistant")
+        self.scheduler = RecalculationScheduler(self.root, self.recalculate)
+        self.worker = BackgroundWorker(self.root)
+        # Solved heads-up endgames, if perudo_endgame.py has been run
+        self.endgame = EndgameSolver.load(DEFAULT_TABLE_PATH) if os.path.exists(DEFAULT_TABLE_PATH) else None
+        # Session log for perudo_recording.py, if PERUDO_RECORD names a file
+        self.recorder = None
+        if os.environ.get(RECORD_ENV_VAR):
+            self.recorder = SessionRecorder(os.environ[RECORD_ENV_VAR])
+            atexit.register(self.recorder.close)
+        # Opponent history across sessions, used as priors for hand inference
+        self.stats = OpponentStats()
+        atexit.register(self.stats.close)
+        # Opponents' bids wait here until they can't be undone any more
+        self.unsaved_bids = []
+        self.resolved_bids = 0
+        atexit.register(self.save_bid_stats)
         
         # Setup variables
         self.num_opponents = tk.IntVar(value=3)
@@ -27,18 +183,36 @@ class PerudoCalculator:
         self.bid_face = tk.IntVar(value=1)
         self.probability = tk.StringVar(value="Probability will appear here")
         self.suspected_probability = tk.StringVar(value="Suspected probability will appear here")
+        self.recommendations = tk.StringVar(value="Recommendations will appear here")
         self.your_dice_vars = []
-        self.opponent_dice_vars = []
-        self.opponent_suspected_vars = []
+        self.opponent_rows = []
+        self.state = None
+        self.bid_history = BidHistory()
+        self.bidder = tk.StringVar(value="P1")
+        self.caller = tk.StringVar(value="Me")
+        self.actual_count = tk.IntVar(value=0)
+        self.bidder_support = tk.StringVar(value="")
+        self.dudo_result = tk.StringVar(value="")
+        self.rules_name = tk.StringVar(value=STANDARD.name)
         self.allow_more_players = tk.BooleanVar(value=False)
+        self.show_heatmap = tk.BooleanVar(value=True)
+        self.heatmap_use_suspected = tk.BooleanVar(value=False)
+        # Canvas items of the drawn grid, kept between redraws
+        self.heatmap_size = 0
+        self.heatmap_cells = []
+        self.heatmap_values = []
+        self.heatmap_current = None
         
         self.create_widgets()
         self.create_opponent_inputs()
         self.create_your_dice_inputs()
-        self.update_total_dice()
         
         # Set up automatic calculation triggers
         self.setup_automatic_calculation()
+        self.scheduler.mark_dirty("dice")
+        # Tables for every variant up front, so switching rules is only a lookup
+        self.worker.submit("prewarm", lambda: [prewarm_tail_tables(PREWARM_DICE, rules) for rules in VARIANTS.values()], 
+                           (), None)
         
         # Make window resizable and set minimum size
         self.root.minsize(900, 600)
@@ -46,16 +220,19 @@ class PerudoCalculator:
         self.root.rowconfigure(0, weight=1)
     
     def setup_automatic_calculation(self):
+        # Runs once; dice variables are watched as they are created
         self.num_opponents.trace_add("write", lambda *args: self.update_opponents())
-        self.bid_quantity.trace_add("write", lambda *args: self.calculate_probability())
-        self.bid_face.trace_add("write", lambda *args: self.calculate_probability())
         self.allow_more_players.trace_add("write", lambda *args: self.on_allow_more_players_changed())
-        
-        for var in self.opponent_dice_vars:
-            var.trace_add("write", lambda *args: self.update_total_dice())
-        
-        for var in self.your_dice_vars:
-            var.trace_add("write", lambda *args: self.update_total_dice())
+        self.scheduler.watch(self.bid_quantity, "bid")
+        self.scheduler.watch(self.bid_face, "bid")
+        self.scheduler.watch(self.rules_name, "rules")
+        self.scheduler.watch(self.show_heatmap, "heatmap")
+        self.scheduler.watch(self.heatmap_use_suspected, "heatmap")
+    
+    def recalculate(self, changed):
+        if "dice" in changed:
+            self.update_total_dice()
+        self.calculate_probability()
     
     def create_widgets(self):
         style = ttk.Style()
@@ -119,6 +296,45 @@ class PerudoCalculator:
         ttk.Spinbox(bid_row, from_=1, to=6, textvariable=self.bid_face, 
                    width=5).pack(side=tk.LEFT)
         
+        ttk.Label(bid_row, text="Rules:").pack(side=tk.LEFT, padx=(15, 5))
+        ttk.Combobox(bid_row, textvariable=self.rules_name, values=list(VARIANTS), 
+                    width=10, state="readonly").pack(side=tk.LEFT)
+        
+        # Bid history feeds the hand inference for each opponent
+        history_row = ttk.Frame(bid_frame)
+        history_row.grid(row=1, column=0, sticky="w", padx=5, pady=(0, 5))
+        
+        ttk.Label(history_row, text="Bid By:").pack(side=tk.LEFT, padx=(0, 5))
+        self.bidder_combobox = ttk.Combobox(history_row, textvariable=self.bidder, 
+                                            width=5, state="readonly")
+        self.bidder_combobox.pack(side=tk.LEFT, padx=(0, 10))
+        
+        ttk.Button(history_row, text="Record Bid", 
+                  command=self.record_bid).pack(side=tk.LEFT, padx=2)
+        ttk.Button(history_row, text="Undo", 
+                  command=self.undo_bid).pack(side=tk.LEFT, padx=2)
+        ttk.Button(history_row, text="New Round", 
+                  command=self.new_round).pack(side=tk.LEFT, padx=2)
+        
+        # After a dudo: how many dice actually matched the last bid
+        ttk.Label(history_row, text="Actual Count:").pack(side=tk.LEFT, padx=(15, 5))
+        ttk.Spinbox(history_row, from_=0, to=50, textvariable=self.actual_count, 
+                   width=4).pack(side=tk.LEFT)
+        # and how many of those were the bidder's own, if you saw (optional)
+        ttk.Label(history_row, text="Bidder Had:").pack(side=tk.LEFT, padx=(10, 5))
+        ttk.Entry(history_row, textvariable=self.bidder_support, width=4).pack(side=tk.LEFT)
+        # and who called it
+        ttk.Label(history_row, text="Called By:").pack(side=tk.LEFT, padx=(10, 5))
+        self.caller_combobox = ttk.Combobox(history_row, textvariable=self.caller, 
+                                            width=5, state="readonly")
+        self.caller_combobox.pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Button(history_row, text="Resolve Dudo", 
+                  command=self.resolve_dudo).pack(side=tk.LEFT, padx=2)
+        
+        self.history_listbox = tk.Listbox(bid_frame, height=4)
+        self.history_listbox.grid(row=2, column=0, sticky="ew", padx=5, pady=(0, 5))
+        ttk.Label(bid_frame, textvariable=self.dudo_result).grid(row=3, column=0, sticky="w", padx=5, pady=(0, 5))
+        
         your_dice_container = ttk.LabelFrame(main_frame, text="Your Dice")
         your_dice_container.grid(row=3, column=0, sticky="ew", pady=5)
         your_dice_container.columnconfigure(0, weight=1)
@@ -157,63 +373,149 @@ class PerudoCalculator:
         suspected_label = ttk.Label(suspected_frame, textvariable=self.suspected_probability, 
                                    font=("Arial", 10, "bold"), foreground="green")
         suspected_label.pack(side=tk.LEFT, padx=10)
+        
+        heatmap_frame = ttk.LabelFrame(main_frame, text="Bid Heatmap")
+        heatmap_frame.grid(row=6, column=0, sticky="ew", pady=5)
+        heatmap_frame.columnconfigure(0, weight=1)
+        
+        heatmap_options = ttk.Frame(heatmap_frame)
+        heatmap_options.grid(row=0, column=0, sticky="w", padx=5)
+        
+        ttk.Checkbutton(heatmap_options, text="Show Heatmap", 
+                      variable=self.show_heatmap).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Checkbutton(heatmap_options, text="Use Suspected Dice", 
+                      variable=self.heatmap_use_suspected).pack(side=tk.LEFT)
+        
+        self.heatmap_canvas = tk.Canvas(heatmap_frame, height=HEATMAP_CELL_HEIGHT * 7 + 4, 
+                                        highlightthickness=0)
+        self.heatmap_canvas.grid(row=1, column=0, sticky="ew", padx=5, pady=(5, 0))
+        heatmap_scroll = ttk.Scrollbar(heatmap_frame, orient=tk.HORIZONTAL, 
+                                      command=self.heatmap_canvas.xview)
+        heatmap_scroll.grid(row=2, column=0, sticky="ew", padx=5)
+        self.heatmap_canvas.configure(xscrollcommand=heatmap_scroll.set)
+        self.heatmap_canvas.bind("<Button-1>", self.on_heatmap_click)
+        
+        recommendation_frame = ttk.LabelFrame(main_frame, text="Recommended Actions (With Suspected Dice)")
+        recommendation_frame.grid(row=7, column=0, sticky="ew", pady=5)
+        
+        ttk.Label(recommendation_frame, textvariable=self.recommendations, 
+                 justify=tk.LEFT).grid(row=0, column=0, sticky="w", padx=5)
+        
+        if PROFILE_OVERLAY:
+            profile_frame = ttk.LabelFrame(main_frame, text="Performance")
+            profile_frame.grid(row=8, column=0, sticky="ew", pady=5)
+            self.profile_text = tk.StringVar(value="")
+            ttk.Label(profile_frame, textvariable=self.profile_text, font=("Courier", 9), 
+                     justify=tk.LEFT).grid(row=0, column=0, sticky="w", padx=5)
+            self.refresh_profile_overlay()
+    
+    def refresh_profile_overlay(self):
+        summary = metrics.format_summary()
+        self.profile_text.set(f"{summary}\nrecomputations: {self.scheduler.compute_count}, "
+                              f"analyses: {self.worker.completed} done / {self.worker.skipped} dropped")
+        self.root.after(PROFILE_REFRESH_MS, self.refresh_profile_overlay)
     
+    @timed("create_opponent_inputs")
     def create_opponent_inputs(self):
-        # Preserve existing suspected dice
-        current_suspected = self.opponent_suspected_vars.copy()
-        self.opponent_suspected_vars = []
-        
-        for widget in self.opponent_frame.winfo_children():
-            widget.destroy()
-        self.opponent_dice_vars = []
-        
         opponents_container = ttk.Frame(self.opponent_frame)
         opponents_container.grid(row=0, column=0, sticky="w")
         
         ttk.Label(opponents_container, text="Dice per Opponent:").pack(side=tk.LEFT, padx=(0, 10))
         
-        opponents_dice_frame = ttk.Frame(opponents_container)
-        opponents_dice_frame.pack(side=tk.LEFT)
+        self.opponents_dice_frame = ttk.Frame(opponents_container)
+        self.opponents_dice_frame.pack(side=tk.LEFT)
         
-        for i in range(self.num_opponents.get()):
-            opp_container = ttk.Frame(opponents_dice_frame)
-            opp_container.pack(side=tk.LEFT, padx=5)
-            
-            opp_row = ttk.Frame(opp_container)
-            opp_row.pack()
-            
-            ttk.Label(opp_row, text=f"P{i+1}:").pack(side=tk.LEFT)
-            opp_var = tk.IntVar(value=5)
-            spin = ttk.Spinbox(opp_row, from_=1, to=10, textvariable=opp_var, 
-                              width=3)
-            spin.pack(side=tk.LEFT, padx=(0, 10))
-            self.opponent_dice_vars.append(opp_var)
-            
-            suspected_frame = ttk.Frame(opp_container)
-            suspected_frame.pack(fill=tk.X, pady=(2, 0))
-            
-            ttk.Label(suspected_frame, text="Suspected:").pack(side=tk.LEFT)
-            
-            self.suspected_dice_frame = ttk.Frame(suspected_frame)
-            self.suspected_dice_frame.pack(side=tk.LEFT, padx=5)
-            
-            # Preserve suspected dice for existing opponents
-            if i < len(current_suspected):
-                self.opponent_suspected_vars.append(current_suspected[i])
-                self.update_suspected_display(i)
-            else:
-                self.opponent_suspected_vars.append([])
-            
-            # Button frame for suspected actions
-            button_frame = ttk.Frame(opp_container)
-            button_frame.pack(fill=tk.X, pady=(5, 0))
-            
-            ttk.Button(button_frame, text="Set Suspected", 
-                      command=lambda idx=i: self.set_suspected_dice(idx)).pack(side=tk.LEFT, padx=2)
-            
-            # Clear suspicion button
-            ttk.Button(button_frame, text="Clear", 
-                      command=lambda idx=i: self.clear_suspected_dice(idx)).pack(side=tk.LEFT, padx=2)
+        self.sync_opponent_rows()
+    
+    @timed("sync_opponent_rows")
+    def sync_opponent_rows(self):
+        # Only the rows for added or removed opponents are touched
+        target = self.num_opponents.get()
+        while len(self.opponent_rows) > target:
+            self.opponent_rows.pop().destroy()
+        while len(self.opponent_rows) < target:
+            row = OpponentRow(self.opponents_dice_frame, len(self.opponent_rows), self)
+            self.scheduler.watch(row.dice_var, "dice")
+            self.opponent_rows.append(row)
+        
+        bidders = ["Me"] + [f"P{i+1}" for i in range(target)]
+        self.bidder_combobox.config(values=bidders)
+        if self.bidder.get() not in bidders:
+            self.bidder.set(bidders[-1])
+        self.caller_combobox.config(values=bidders)
+        if self.caller.get() not in bidders:
+            self.caller.set("Me")
+    
+    def record_bid(self):
+        bidder = self.bidder.get()
+        opponent = None if bidder == "Me" else int(bidder[1:]) - 1
+        dice_count = self.opponent_rows[opponent].dice_var.get() if opponent is not None else None
+        bid_q = self.bid_quantity.get()
+        bid_f = self.bid_face.get()
+        
+        if opponent is not None:
+            name = self.opponent_rows[opponent].name_var.get()
+            self.bid_history.set_model(opponent, self.stats.model(name))
+        self.unsaved_bids.append((name, dice_count, bid_q, bid_f) if opponent is not None else None)
+        self.bid_history.record_bid(opponent, dice_count, bid_q, bid_f, self.total_dice.get(), 
+                                    VARIANTS[self.rules_name.get()])
+        if self.recorder:
+            self.recorder.record_bid(opponent, dice_count, bid_q, bid_f)
+        self.history_listbox.insert(tk.END, f"{bidder}: {bid_q} x {bid_f}s")
+        self.history_listbox.see(tk.END)
+        self.scheduler.mark_dirty("history")
+    
+    def undo_bid(self):
+        # A bid that was called and resolved stays
+        if len(self.bid_history.bids) <= self.resolved_bids:
+            return
+        self.bid_history.undo_last()
+        self.unsaved_bids.pop()
+        if self.recorder:
+            self.recorder.undo_bid()
+        self.history_listbox.delete(tk.END)
+        self.scheduler.mark_dirty("history")
+    
+    def resolve_dudo(self):
+        # The last recorded bid was called; log whether it held, whether
+        # its caller was right and, if their dice were entered, whether its
+        # bidder bluffed
+        if len(self.bid_history.bids) <= self.resolved_bids:
+            return
+        opponent, bid_q, bid_f = self.bid_history.bids[-1]
+        try:
+            held = self.actual_count.get() >= bid_q
+        except tk.TclError:
+            return
+        support = self.bidder_support.get().strip()
+        support = int(support) if support.isdigit() else None
+        self.resolved_bids = len(self.bid_history.bids)
+        self.save_bid_stats()
+        if opponent is not None and opponent < len(self.opponent_rows):
+            self.stats.record_showdown(self.opponent_rows[opponent].name_var.get(), bid_q, bid_f, held, support)
+        bidder = "Me" if opponent is None else f"P{opponent+1}"
+        caller = self.caller.get()
+        if caller != "Me" and caller != bidder:
+            self.stats.record_call(self.opponent_rows[int(caller[1:]) - 1].name_var.get(), bid_q, bid_f, not held)
+        self.dudo_result.set(f"Dudo by {caller}: {bidder}'s {bid_q} x {bid_f}s {'held' if held else 'failed'}")
+        self.stats.flush()
+    
+    def save_bid_stats(self):
+        for bid in self.unsaved_bids:
+            if bid is not None:
+                self.stats.record_bid(*bid)
+        self.unsaved_bids = []
+    
+    def new_round(self):
+        self.save_bid_stats()
+        self.resolved_bids = 0
+        self.dudo_result.set("")
+        self.bidder_support.set("")
+        self.bid_history.clear()
+        if self.recorder:
+            self.recorder.new_round()
+        self.history_listbox.delete(0, tk.END)
+        self.scheduler.mark_dirty("history")
     
     def create_your_dice_inputs(self):
         for widget in self.your_dice_frame.winfo_children():
@@ -230,9 +532,6 @@ class PerudoCalculator:
         
         for _ in range(5):
             self.add_die("1")
-        
-        self.update_total_dice()
-        self.calculate_probability()
     
     def add_die(self, initial_value=""):
         if len(self.your_dice_vars) >= 5:
@@ -256,10 +555,10 @@ class PerudoCalculator:
         die_combobox.bind('<KeyRelease>', lambda e: self.validate_die_input(e, die_var))
         die_combobox.bind('<FocusOut>', lambda e: self.validate_die_input(e, die_var))
         
-        die_var.trace_add("write", lambda *args: self.update_total_dice())
+        self.scheduler.watch(die_var, "dice")
         
         self.update_dice_button_states()
-        self.update_total_dice()
+        self.scheduler.mark_dirty("dice")
     
     def validate_die_input(self, event, die_var):
         value = die_var.get()
@@ -277,7 +576,7 @@ class PerudoCalculator:
         
         self.renumber_dice()
         self.update_dice_button_states()
-        self.update_total_dice()
+        self.scheduler.mark_dirty("dice")
     
     def update_dice_button_states(self):
         dice_count = len(self.your_dice_vars)
@@ -314,13 +613,15 @@ class PerudoCalculator:
     def reset_table(self):
         self.num_opponents.set(3)
         self.opponent_count_label.config(text="3")
-        self.create_opponent_inputs()
+        for row in self.opponent_rows:
+            row.dice_var.set(5)
+            row.clear_suspected()
+            row.update_suspected_display()
         self.reset_your_dice_to_ones()
         self.bid_quantity.set(1)
         self.bid_face.set(1)
-        self.opponent_suspected_vars = []
-        self.update_total_dice()
-        self.setup_automatic_calculation()
+        self.new_round()
+        self.scheduler.mark_dirty("dice")
     
     def reset_your_dice(self):
         self.reset_your_dice_to_ones()
@@ -334,17 +635,9 @@ class PerudoCalculator:
         main_frame = ttk.Frame(popup, padding=10)
         main_frame.pack(fill=tk.BOTH, expand=True)
         
-        dice_count = self.opponent_dice_vars[opponent_idx].get()
-        
-        if len(self.opponent_suspected_vars) <= opponent_idx:
-            self.opponent_suspected_vars.append([tk.StringVar(value="") for _ in range(dice_count)])
-        else:
-            current = self.opponent_suspected_vars[opponent_idx]
-            if len(current) < dice_count:
-                for _ in range(dice_count - len(current)):
-                    current.append(tk.StringVar(value=""))
-            elif len(current) > dice_count:
-                self.opponent_suspected_vars[opponent_idx] = current[:dice_count]
+        row = self.opponent_rows[opponent_idx]
+        dice_count = row.dice_var.get()
+        row.resize_suspected(dice_count)
         
         dice_frame = ttk.Frame(main_frame)
         dice_frame.pack(fill=tk.X, pady=10)
@@ -361,17 +654,21 @@ class PerudoCalculator:
             ttk.Label(die_frame, text=f"Die {i+1}:").pack()
             
             die_combobox = ttk.Combobox(die_frame, 
-                                        textvariable=self.opponent_suspected_vars[opponent_idx][i], 
+                                        textvariable=row.suspected_vars[i], 
                                         values=["", "1", "2", "3", "4", "5", "6"], 
                                         width=4, state="normal")
             die_combobox.pack()
             
             die_combobox.bind('<KeyRelease>', 
-                             lambda e, var=self.opponent_suspected_vars[opponent_idx][i]: 
+                             lambda e, var=row.suspected_vars[i]: 
                              self.validate_die_input(e, var))
             die_combobox.bind('<FocusOut>', 
-                             lambda e, var=self.opponent_suspected_vars[opponent_idx][i]: 
+                             lambda e, var=row.suspected_vars[i]: 
                              self.validate_die_input(e, var))
+            
+            ttk.Label(die_frame, text="Sure %:").pack()
+            ttk.Spinbox(die_frame, from_=0, to=100, increment=10, 
+                       textvariable=row.confidence_vars[i], width=4).pack()
         
         button_row = ttk.Frame(main_frame)
         button_row.pack(pady=10)
@@ -386,58 +683,42 @@ class PerudoCalculator:
         
         popup.update_idletasks()
         width = max(400, dice_count * 60 + 50)
-        height = 200
+        height = 250
         popup.geometry(f"{width}x{height}")
     
     # Clear suspected dice for an opponent
     def clear_suspected_dice(self, opponent_idx, popup=None):
-        if opponent_idx < len(self.opponent_suspected_vars):
+        if opponent_idx < len(self.opponent_rows):
+            row = self.opponent_rows[opponent_idx]
             # Reset all dice to blank
-            for die_var in self.opponent_suspected_vars[opponent_idx]:
+            for die_var in row.suspected_vars:
                 die_var.set("")
+            for confidence_var in row.confidence_vars:
+                confidence_var.set(100)
             
             # Update display
-            self.update_suspected_display(opponent_idx)
+            row.update_suspected_display()
             
             # Recalculate probability
-            self.calculate_probability()
+            self.scheduler.mark_dirty("suspected")
             
             # Close popup if it's open
             if popup:
                 popup.destroy()
     
     def update_suspected_display(self, opponent_idx):
-        if opponent_idx < len(self.opponent_suspected_vars):
-            suspected_list = self.opponent_suspected_vars[opponent_idx]
-            
-            opponents_container = self.opponent_frame.winfo_children()[0]
-            opponents_dice_frame = opponents_container.winfo_children()[1]
-            opp_widgets = opponents_dice_frame.winfo_children()
-            opp_widget = opp_widgets[opponent_idx]
-            
-            suspected_frame = opp_widget.winfo_children()[1]
-            suspected_dice_frame = suspected_frame.winfo_children()[1]
-            
-            for widget in suspected_dice_frame.winfo_children():
-                widget.destroy()
-            
-            for i, die_var in enumerate(suspected_list):
-                face = die_var.get()
-                if face:
-                    label = ttk.Label(suspected_dice_frame, text=face, 
-                                    background="light yellow", relief="solid", 
-                                    width=2, padding=2)
-                    label.pack(side=tk.LEFT, padx=2)
+        if opponent_idx < len(self.opponent_rows):
+            self.opponent_rows[opponent_idx].update_suspected_display()
     
     def save_suspected_dice(self, popup, opponent_idx):
         popup.destroy()
-        self.calculate_probability()
+        self.scheduler.mark_dirty("suspected")
     
     def update_opponents(self):
-        self.create_opponent_inputs()
-        self.setup_automatic_calculation()
-        self.update_total_dice()
+        self.sync_opponent_rows()
+        self.scheduler.mark_dirty("dice")
     
+    @timed("update_total_dice")
     def update_total_dice(self):
         total = 0
         
@@ -445,93 +726,189 @@ class PerudoCalculator:
             if die_var.get() != "":
                 total += 1
         
-        for opp_var in self.opponent_dice_vars:
-            total += opp_var.get()
+        for row in self.opponent_rows:
+            total += row.dice_var.get()
             
         self.total_dice.set(total)
-        self.calculate_probability()
     
+    def build_state(self):
+        # The only place the calculation reads the Tk variables
+        your_dice = [int(value) for value in (var.get() for var in self.your_dice_vars) if value != ""]
+        dice_counts = [row.dice_var.get() for row in self.opponent_rows]
+        suspected_dice = [row.suspected_dice() for row in self.opponent_rows]
+        
+        return GameState.from_values(your_dice, dice_counts, suspected_dice, 
+                                     self.bid_quantity.get(), self.bid_face.get())
+    
+    @timed("calculate_probability")
     def calculate_probability(self):
+        # Cheap exact results go straight to the labels; the grid, the
+        # recommendations and inferred hands are refined by the worker
         try:
-            total_dice = self.total_dice.get()
-            bid_q = self.bid_quantity.get()
-            bid_f = self.bid_face.get()
+            state = self.build_state()
+            self.state = state
+            rules = VARIANTS[self.rules_name.get()]
+            if self.recorder:
+                self.recorder.record_state(state, rules)
+            total_dice = state.total_dice
             
             if total_dice <= 0:
+                self.worker.cancel("analysis")
                 self.probability.set("Invalid dice count")
                 self.suspected_probability.set("Invalid dice count")
+                self.clear_heatmap()
+                self.recommendations.set("")
                 return
             
-            known_successes = 0
-            your_dice_count = 0
-            for die_var in self.your_dice_vars:
-                value = die_var.get()
-                if value == "":
-                    continue
-                    
-                your_dice_count += 1
-                face = int(value)
-                if face == bid_f or (face == 1 and bid_f != 1):
-                    known_successes += 1
+            # Opponents with recorded bids use their inferred hand instead of guesses
+            dice_counts = list(state.opponent_dice)
+            inferred_opponents = self.bid_history.inferred_opponents(dice_counts)
+            if inferred_opponents:
+                state = state.without_suspected(inferred_opponents)
             
-            base_unknown_dice = total_dice - your_dice_count
-            base_prob = self.calculate_cumulative_probability(known_successes, base_unknown_dice, bid_f, bid_q)
+            result = evaluate_state(state, rules)
             
-            base_info = f" (Known: {known_successes}, Unknown: {base_unknown_dice})"
-            self.probability.set(f"{base_prob*100:.2f}%{base_info}")
+            base_info = f" (Known: {result.known_successes}, Unknown: {result.unknown_dice})"
+            self.probability.set(f"{result.base_prob*100:.2f}%{base_info}")
             
-            if len(self.opponent_suspected_vars) > 0:
-                suspected_successes = known_successes
-                suspected_dice_count = your_dice_count
-                
-                for opp_idx, suspected_list in enumerate(self.opponent_suspected_vars):
-                    if opp_idx >= len(self.opponent_dice_vars):
-                        continue
-                    
-                    opp_dice_count = self.opponent_dice_vars[opp_idx].get()
-                    
-                    for i in range(min(len(suspected_list), opp_dice_count)):
-                        value = suspected_list[i].get()
-                        if value == "":
-                            continue
-                            
-                        suspected_dice_count += 1
-                        face = int(value)
-                        if face == bid_f or (face == 1 and bid_f != 1):
-                            suspected_successes += 1
-                
-                suspected_unknown_dice = total_dice - suspected_dice_count
-                suspected_prob = self.calculate_cumulative_probability(suspected_successes, suspected_unknown_dice, bid_f, bid_q)
-                
-                suspected_info = f" (Known: {suspected_successes}, Suspected: {suspected_dice_count - your_dice_count}, Unknown: {suspected_unknown_dice})"
-                self.suspected_probability.set(f"{suspected_prob*100:.2f}%{suspected_info}")
+            if len(self.opponent_rows) > 0:
+                refining = " - refining..." if inferred_opponents else ""
+                self.suspected_probability.set(self.format_suspected(result) + refining)
             else:
                 self.suspected_probability.set("Set suspected dice to see this probability")
+            
+            self.worker.submit("analysis", analyse_table, 
+                               (total_dice, list(state.your_dice), state.suspected_dice, dice_counts, 
+                                state.bid_q, state.bid_f, 
+                                self.bid_history.snapshot(), self.heatmap_use_suspected.get(), 
+                                RECOMMENDATION_COUNT, rules, self.show_heatmap.get()), 
+                               self.apply_analysis)
                 
         except Exception as e:
+            self.worker.cancel("analysis")
             self.probability.set(f"Error: {str(e)}")
             self.suspected_probability.set(f"Error: {str(e)}")
     
-    def calculate_cumulative_probability(self, known_successes, unknown_dice, bid_f, bid_q):
-        required_unknown = max(0, bid_q - known_successes)
+    def format_suspected(self, result):
+        suspected_info = f" (Known: {result.suspected_successes}, Suspected: {result.suspected_dice}, Unknown: {result.suspected_unknown_dice})"
+        if result.inferred_dice:
+            suspected_info = f"{suspected_info[:-1]}, Inferred: {result.inferred_dice})"
+        return f"{result.suspected_prob*100:.2f}%{suspected_info}"
+    
+    def apply_analysis(self, analysis):
+        if isinstance(analysis, Exception):
+            self.suspected_probability.set(f"Error: {str(analysis)}")
+            self.recommendations.set("")
+            return
         
-        if unknown_dice <= 0:
-            if required_unknown <= 0:
-                return 1.0
-            else:
-                return 0.0
-        else:
-            p_success = 1/6 if bid_f == 1 else 1/3
-            
-            if required_unknown == 0:
-                return 1.0
-            elif required_unknown > unknown_dice:
-                return 0.0
-            else:
-                prob = 0.0
-                for k in range(required_unknown, unknown_dice + 1):
-                    prob += calculate_binomial_probability(unknown_dice, p_success, k)
-                return prob
+        if len(self.opponent_rows) > 0:
+            self.suspected_probability.set(self.format_suspected(analysis.result))
+        self.draw_heatmap(analysis.grid, analysis.bid_q, analysis.bid_f)
+        lines = [describe_action(action) for action in analysis.actions]
+        endgame_line = self.endgame_advice(analysis.bid_q, analysis.bid_f)
+        if endgame_line:
+            lines.insert(0, endgame_line)
+        self.recommendations.set("\n".join(lines))
+    
+    def endgame_advice(self, bid_q, bid_f):
+        # Heads-up with every one of your dice filled in
+        if self.endgame is None or self.state is None or len(self.opponent_rows) != 1:
+            return None
+        if self.rules_name.get() != STANDARD.name:
+            return None
+        if len(self.state.your_dice) != len(self.your_dice_vars):
+            return None
+        action = self.endgame.best_action(list(self.state.your_dice), self.state.opponent_dice[0], 
+                                          (bid_q, bid_f))
+        if action is None:
+            return None
+        if action.kind == DUDO:
+            return f"Endgame table: Dudo on {action.quantity} x {action.face}s"
+        return f"Endgame table: Raise to {action.quantity} x {action.face}s"
+    
+    def clear_heatmap(self):
+        self.heatmap_canvas.delete("all")
+        self.heatmap_canvas.configure(scrollregion=(0, 0, 0, 0))
+        self.heatmap_size = 0
+        self.heatmap_cells = []
+        self.heatmap_values = []
+        self.heatmap_current = None
+    
+    def draw_heatmap(self, grid, bid_q, bid_f):
+        if grid is None or not self.show_heatmap.get():
+            if self.heatmap_size:
+                self.clear_heatmap()
+            return
+        
+        if len(grid) != self.heatmap_size:
+            self.create_heatmap_cells(len(grid))
+        
+        # Only cells whose value changed are touched
+        canvas = self.heatmap_canvas
+        values = self.heatmap_values
+        for bid_quantity, row in enumerate(grid):
+            for face, prob in enumerate(row):
+                index = bid_quantity * 6 + face
+                value = (heatmap_color(prob), f"{prob*100:.0f}")
+                if values[index] != value:
+                    rectangle, text = self.heatmap_cells[index]
+                    if values[index] is None or values[index][0] != value[0]:
+                        canvas.itemconfigure(rectangle, fill=value[0])
+                    if values[index] is None or values[index][1] != value[1]:
+                        canvas.itemconfigure(text, text=value[1])
+                    values[index] = value
+        
+        current = (bid_q - 1) * 6 + bid_f - 1 if 1 <= bid_q <= len(grid) and 1 <= bid_f <= 6 else None
+        if current != self.heatmap_current:
+            if self.heatmap_current is not None:
+                canvas.itemconfigure(self.heatmap_cells[self.heatmap_current][0], outline="white", width=1)
+            if current is not None:
+                canvas.itemconfigure(self.heatmap_cells[current][0], outline="black", width=2)
+            self.heatmap_current = current
+    
+    def create_heatmap_cells(self, total_dice):
+        # Runs when the table size changes; later redraws only recolour
+        canvas = self.heatmap_canvas
+        canvas.delete("all")
+        
+        # Faces down the side, quantities along the top
+        for bid_quantity in range(1, total_dice + 1):
+            x = HEATMAP_LABEL_WIDTH + (bid_quantity - 1) * HEATMAP_CELL_WIDTH
+            canvas.create_text(x + HEATMAP_CELL_WIDTH / 2, HEATMAP_CELL_HEIGHT / 2, 
+                               text=str(bid_quantity))
+        for face in range(1, 7):
+            y = face * HEATMAP_CELL_HEIGHT
+            canvas.create_text(HEATMAP_LABEL_WIDTH / 2, y + HEATMAP_CELL_HEIGHT / 2, 
+                               text=f"{face}s")
+        
+        self.heatmap_cells = []
+        for bid_quantity in range(1, total_dice + 1):
+            x = HEATMAP_LABEL_WIDTH + (bid_quantity - 1) * HEATMAP_CELL_WIDTH
+            for face in range(1, 7):
+                y = face * HEATMAP_CELL_HEIGHT
+                rectangle = canvas.create_rectangle(x, y, x + HEATMAP_CELL_WIDTH, y + HEATMAP_CELL_HEIGHT, 
+                                                    outline="white", width=1)
+                text = canvas.create_text(x + HEATMAP_CELL_WIDTH / 2, y + HEATMAP_CELL_HEIGHT / 2, 
+                                          font=("Arial", 8))
+                self.heatmap_cells.append((rectangle, text))
+        self.heatmap_values = [None] * len(self.heatmap_cells)
+        self.heatmap_current = None
+        self.heatmap_size = total_dice
+        
+        width = HEATMAP_LABEL_WIDTH + total_dice * HEATMAP_CELL_WIDTH
+        canvas.configure(scrollregion=(0, 0, width, HEATMAP_CELL_HEIGHT * 7))
+    
+    def on_heatmap_click(self, event):
+        # Clicking a cell makes it the current bid
+        x = self.heatmap_canvas.canvasx(event.x)
+        bid_quantity = int((x - HEATMAP_LABEL_WIDTH) // HEATMAP_CELL_WIDTH) + 1
+        face = int(event.y // HEATMAP_CELL_HEIGHT)
+        if x < HEATMAP_LABEL_WIDTH or not 1 <= face <= 6:
+            return
+        if bid_quantity > self.total_dice.get():
+            return
+        self.bid_quantity.set(bid_quantity)
+        self.bid_face.set(face)
 
 if __name__ == "__main__":
     root = tk.Tk()
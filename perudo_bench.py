@@ -0,0 +1,267 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import timeit
+from fractions import Fraction
+
+from perudo_engine import (binomial_coefficient, binomial_tail, build_tail_table, calculate_binomial_probability,
+                           calculate_cumulative_probability, tail_cache)
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Perudo-Assistant.py")
+TABLE_SIZES = [5, 10, 20, 40, 100, 1000]
+REPEATS = 5
+DEFAULT_TOLERANCE = 0.25
+SETTLE_TIMEOUT = 10.0
+CHECK_SIZES = [5, 10, 20, 40, 100, 1000, 50000]
+CHECK_PROBABILITIES = [Fraction(1, 6), Fraction(1, 3)]
+CHECK_TOLERANCE = 1e-9
+
+# python perudo_bench.py                       run everything and print the numbers
+# python perudo_bench.py --save base.json      ...and keep them as a baseline
+# python perudo_bench.py --compare base.json   flag anything slower than the baseline
+# python perudo_bench.py --check               check the tail tables and the beta tail
+#                                              against exact sums; exits 1 if off
+#
+# Engine results are ns per call (best of REPEATS). GUI storms drive a real
+# PerudoCalculator; without a display they start Xvfb when it is installed.
+
+def time_call(function, *args):
+    timer = timeit.Timer(lambda: function(*args))
+    number, _ = timer.autorange()
+    return min(timer.repeat(REPEATS, number)) / number * 1e9
+
+def cold_cumulative(known_successes, unknown_dice, bid_f, bid_q):
+    # Includes building the tail table
+    tail_cache.clear()
+    return calculate_cumulative_probability(known_successes, unknown_dice, bid_f, bid_q)
+
+def bench_engine(sizes=TABLE_SIZES):
+    results = {}
+    for n in sizes:
+        k = n // 3
+        results[f"binomial_coefficient/n={n}"] = time_call(binomial_coefficient, n, k)
+        results[f"calculate_binomial_probability/n={n}"] = time_call(calculate_binomial_probability, n, 1/3, k)
+        calculate_cumulative_probability(1, n - 1, 3, k)
+        results[f"calculate_cumulative_probability/n={n}"] = time_call(calculate_cumulative_probability, 1, n - 1, 3, k)
+        results[f"calculate_cumulative_probability_cold/n={n}"] = time_call(cold_cumulative, 1, n - 1, 3, k)
+    return {name: {"ns_per_call": ns} for name, ns in results.items()}
+
+def exact_tail_table(n, p):
+    # table[k] = P(X >= k) summed exactly, as integers over p.denominator ** n,
+    # from the top down; each entry is rounded to a float only at the end
+    a, b = p.numerator, p.denominator
+    denominator = b ** n
+    table = [0.0] * (n + 2)
+    # term = C(n, k) * a**k * (b - a)**(n - k), walked down from k = n
+    term = a ** n
+    running = 0
+    for k in range(n, -1, -1):
+        running += term
+        table[k] = running / denominator
+        if k:
+            term = term * k * (b - a) // ((n - k + 1) * a)
+    return table
+
+def check_tails(sizes=CHECK_SIZES, probabilities=CHECK_PROBABILITIES):
+    # Worst absolute error of build_tail_table against exact sums, and of
+    # binomial_tail (used above LARGE_TABLE_DICE) against the table
+    results = {}
+    for n in sizes:
+        for p in probabilities:
+            exact = exact_tail_table(n, p)
+            table = build_tail_table(n, float(p))
+            results[f"n={n}/p={p}"] = {
+                "table_vs_exact": max(abs(table[k] - exact[k]) for k in range(n + 1)),
+                "beta_vs_table": max(abs(binomial_tail(n, float(p), k) - table[k]) for k in range(n + 1)),
+            }
+    return results
+
+def start_display():
+    # Returns an Xvfb process to stop afterwards, or None if a display is
+    # already there (or Xvfb isn't installed)
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin") or not shutil.which("Xvfb"):
+        return None
+    display = f":{90 + os.getpid() % 100}"
+    process = subprocess.Popen(["Xvfb", display, "-screen", "0", "1280x1024x24", "-nolisten", "tcp"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(0.5)
+    os.environ["DISPLAY"] = display
+    return process
+
+def load_app():
+    spec = importlib.util.spec_from_file_location("perudo_assistant", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def settle(app):
+    # Let the idle recalculation and the worker finish
+    deadline = time.perf_counter() + SETTLE_TIMEOUT
+    while time.perf_counter() < deadline:
+        app.root.update()
+        if app.scheduler.pending is None and app.worker.outstanding == 0:
+            return
+        time.sleep(0.001)
+
+def storm_add_dice(app, rounds):
+    for _ in range(rounds):
+        for _ in range(4):
+            yield app.remove_die
+        for face in "3456":
+            yield lambda face=face: app.add_die(face)
+
+def storm_toggle_opponents(app, rounds):
+    for _ in range(rounds):
+        for delta in (1, 1, -1, -1):
+            yield lambda delta=delta: app.change_opponents(delta)
+
+def storm_opponent_dice(app, rounds):
+    for i in range(rounds):
+        for row in app.opponent_rows:
+            yield lambda row=row, value=(i % 5) + 1: row.dice_var.set(value)
+
+def storm_bids(app, rounds):
+    for i in range(rounds):
+        yield lambda i=i: app.bid_quantity.set(i % 15 + 1)
+        yield lambda i=i: app.bid_face.set(i % 6 + 1)
+
+def storm_resets(app, rounds):
+    for _ in range(rounds):
+        yield app.reset_table
+
+def storm_typing_burst(app, rounds):
+    # Several edits land before Tk goes idle, e.g. a pasted hand
+    for i in range(rounds):
+        def burst(i=i):
+            for j, var in enumerate(app.your_dice_vars):
+                var.set(str((i + j) % 6 + 1))
+            app.bid_quantity.set(i % 10 + 1)
+        yield burst
+
+STORMS = {
+    "add_dice": (storm_add_dice, 25),
+    "toggle_opponents": (storm_toggle_opponents, 25),
+    "opponent_dice": (storm_opponent_dice, 40),
+    "bids": (storm_bids, 100),
+    "resets": (storm_resets, 50),
+    "typing_burst": (storm_typing_burst, 100),
+}
+
+def run_storm(app, storm, rounds):
+    app.reset_table()
+    settle(app)
+    computes = app.scheduler.compute_count
+    completed = app.worker.completed
+    actions = 0
+    started = time.perf_counter()
+    for action in storm(app, rounds):
+        action()
+        app.root.update()
+        actions += 1
+    settle(app)
+    elapsed = time.perf_counter() - started
+    return {
+        "actions": actions,
+        "recomputations_per_action": (app.scheduler.compute_count - computes) / actions,
+        "analyses_per_action": (app.worker.completed - completed) / actions,
+        "ms_per_action": elapsed / actions * 1000,
+    }
+
+def bench_gui(storms=STORMS):
+    display = start_display()
+    try:
+        try:
+            import tkinter as tk
+            root = tk.Tk()
+        except Exception as e:
+            print(f"Skipping GUI storms: {e}", file=sys.stderr)
+            return None
+        app = None
+        try:
+            app = load_app().PerudoCalculator(root)
+            settle(app)
+            return {name: run_storm(app, storm, rounds) for name, (storm, rounds) in storms.items()}
+        finally:
+            if app is not None:
+                app.worker.shutdown()
+            root.destroy()
+    finally:
+        if display is not None:
+            display.terminate()
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    # Lower is better for every metric; returns the regressions
+    regressions = []
+    for section in ("engine", "gui"):
+        for name, metrics in (current.get(section) or {}).items():
+            old_metrics = (baseline.get(section) or {}).get(name)
+            if not old_metrics:
+                continue
+            for metric, value in metrics.items():
+                old = old_metrics.get(metric)
+                if metric == "actions" or not old:
+                    continue
+                if value > old * (1 + tolerance):
+                    regressions.append((f"{section}/{name}", metric, old, value))
+    return regressions
+
+def print_results(results):
+    for name, metrics in results["engine"].items():
+        print(f"{name:<50} {metrics['ns_per_call']:>12.0f} ns")
+    for name, metrics in (results["gui"] or {}).items():
+        print(f"storm {name:<20} {metrics['actions']:>5} actions  "
+              f"{metrics['recomputations_per_action']:.2f} recomputes/action  "
+              f"{metrics['analyses_per_action']:.2f} analyses/action  "
+              f"{metrics['ms_per_action']:.2f} ms/action")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the probability engine and the GUI recalculation path")
+    parser.add_argument("--save", help="write the results to this baseline file")
+    parser.add_argument("--compare", help="compare against a saved baseline; exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--engine-only", action="store_true")
+    parser.add_argument("--gui-only", action="store_true")
+    parser.add_argument("--check", action="store_true", help="check tail accuracy instead of timing; exits 1 if off")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        failed = False
+        for name, errors in check_tails().items():
+            worst = max(errors.values())
+            failed = failed or worst > CHECK_TOLERANCE
+            print(f"{name:<20} table vs exact {errors['table_vs_exact']:.2e}  "
+                  f"beta vs table {errors['beta_vs_table']:.2e}{'  FAIL' if worst > CHECK_TOLERANCE else ''}")
+        if failed:
+            sys.exit(1)
+        print(f"All within {CHECK_TOLERANCE:g}")
+        return
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "engine": {} if args.gui_only else bench_engine(),
+        "gui": None if args.engine_only else bench_gui(),
+    }
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, metric, old, new in regressions:
+            print(f"REGRESSION {name} {metric}: {old:.4g} -> {new:.4g} (+{(new / old - 1) * 100:.0f}%)")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+
+if __name__ == "__main__":
+    main()
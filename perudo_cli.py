@@ -0,0 +1,173 @@
+import argparse
+import csv
+import io
+import json
+import os
+import struct
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+
+from perudo_decision import recommend_actions, split_suspected
+from perudo_rules import STANDARD, rules_named
+from perudo_state import STATE_CACHE_SIZE, GameState, evaluate_state
+
+CHUNK_SIZE = 2000
+CSV_FIELDS = ["id", "base_prob", "suspected_prob", "known_successes", "unknown_dice",
+              "action", "action_quantity", "action_face", "action_prob", "error"]
+
+# JSONL records look like
+#   {"id": 7, "your_dice": [1, 4, 4], "opponent_dice": [5, 3],
+#    "suspected_dice": [[2, [3, 0.6]], []], "bid": [4, 4], "rules": "palifico"}
+# CSV rows use the same names, with dice space separated, opponents'
+# suspected dice separated by "|" and confidence written as face:0.6:
+#   id,your_dice,opponent_dice,suspected_dice,bid_quantity,bid_face,rules
+#   7,1 4 4,5 3,2 3:0.6|,4,4,palifico
+# rules is optional and names a variant from perudo_rules (standard if
+# left out).
+
+def parse_suspected_die(die):
+    if isinstance(die, list):
+        return (int(die[0]), float(die[1]))
+    return int(die)
+
+def state_from_json(record):
+    bid_q, bid_f = record["bid"] if "bid" in record else (record["bid_quantity"], record["bid_face"])
+    suspected = [[parse_suspected_die(die) for die in dice] for dice in record.get("suspected_dice", [])]
+    return GameState.from_input(record["your_dice"], record["opponent_dice"], suspected, bid_q, bid_f)
+
+def parse_csv_die(text):
+    if ":" in text:
+        face, confidence = text.split(":")
+        return (int(face), float(confidence))
+    return int(text)
+
+def state_from_csv(row):
+    suspected_text = row.get("suspected_dice") or ""
+    suspected = [[parse_csv_die(die) for die in dice.split()] for dice in suspected_text.split("|")] if suspected_text else []
+    return GameState.from_input(row["your_dice"].split(), row["opponent_dice"].split(),
+                                suspected, row["bid_quantity"], row["bid_face"])
+
+@lru_cache(maxsize=STATE_CACHE_SIZE)
+def best_action(state, rules=STANDARD):
+    known, uncertain = split_suspected(state.your_dice, state.suspected_dice)
+    return recommend_actions(state.total_dice, known, state.bid_q, state.bid_f, uncertain, limit=1, rules=rules)[0]
+
+def evaluate_record(record_id, state, recommend, rules=STANDARD):
+    result = evaluate_state(state, rules)
+    output = {
+        "id": record_id,
+        "base_prob": result.base_prob,
+        "suspected_prob": result.suspected_prob,
+        "known_successes": result.known_successes,
+        "unknown_dice": result.unknown_dice,
+    }
+    if recommend:
+        action = best_action(state, rules)
+        output.update(action=action.kind, action_quantity=action.quantity,
+                      action_face=action.face, action_prob=action.probability)
+    return output
+
+def process_chunk(lines, start, input_format, output_format, recommend, header=None):
+    # Runs in a worker: raw input lines in, formatted output text out.
+    # start numbers records that have no id of their own
+    if input_format == "csv":
+        records = csv.DictReader(lines, fieldnames=header)
+    else:
+        records = (line for line in lines if line.strip())
+
+    outputs = []
+    for number, record in enumerate(records, start):
+        record_id = number
+        try:
+            if input_format == "csv":
+                record_id = record.get("id") or number
+                state = state_from_csv(record)
+            else:
+                record = json.loads(record)
+                if not isinstance(record, dict):
+                    raise ValueError("record must be a JSON object")
+                record_id = record.get("id", number)
+                state = state_from_json(record)
+            rules = rules_named(record.get("rules") or STANDARD.name)
+            outputs.append(evaluate_record(record_id, state, recommend, rules))
+        except (ValueError, KeyError, TypeError, IndexError, struct.error) as e:
+            outputs.append({"id": record_id, "error": str(e) or type(e).__name__})
+
+    if output_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, lineterminator="\n")
+        writer.writerows(outputs)
+        return buffer.getvalue()
+    return "".join(json.dumps(output) + "\n" for output in outputs)
+
+def read_chunks(stream, chunk_size):
+    while True:
+        lines = list(islice(stream, chunk_size))
+        if not lines:
+            return
+        yield lines
+
+def bounded_map(executor, function, iterable, window):
+    # Like executor.map but never holds more than window chunks in flight,
+    # so memory stays flat however long the input is
+    pending = deque()
+    for args in iterable:
+        pending.append(executor.submit(function, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def guess_format(path, default="jsonl"):
+    if path and path.lower().endswith(".csv"):
+        return "csv"
+    return default
+
+def run(input_stream, output_stream, input_format="jsonl", output_format="jsonl",
+        workers=None, chunk_size=CHUNK_SIZE, recommend=True):
+    header = None
+    if input_format == "csv":
+        header = next(csv.reader([input_stream.readline()]))
+    if output_format == "csv":
+        output_stream.write(",".join(CSV_FIELDS) + "\n")
+
+    jobs = ((lines, number * chunk_size, input_format, output_format, recommend, header)
+            for number, lines in enumerate(read_chunks(input_stream, chunk_size)))
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for args in jobs:
+            output_stream.write(process_chunk(*args))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for text in bounded_map(executor, process_chunk, jobs, workers * 2):
+            output_stream.write(text)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score Perudo game states in bulk from JSONL or CSV")
+    parser.add_argument("input", nargs="?", help="input file (default: stdin)")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument("--input-format", choices=["jsonl", "csv"])
+    parser.add_argument("--output-format", choices=["jsonl", "csv"])
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--no-recommend", action="store_true", help="skip the best next action")
+    args = parser.parse_args(argv)
+
+    input_format = args.input_format or guess_format(args.input)
+    output_format = args.output_format or guess_format(args.output, input_format)
+    input_stream = open(args.input, newline="") if args.input else sys.stdin
+    output_stream = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        run(input_stream, output_stream, input_format, output_format,
+            args.workers, args.chunk_size, not args.no_recommend)
+    finally:
+        if args.input:
+            input_stream.close()
+        if args.output:
+            output_stream.close()
+
+if __name__ == "__main__":
+    main()
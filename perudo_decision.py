@@ -0,0 +1,131 @@
+from collections import namedtuple
+
+from perudo_engine import (calculate_probabilities, calculate_uncertain_probability,
+                           count_successes, die_success_probability, score_bid_grid)
+from perudo_rules import STANDARD
+
+Action = namedtuple("Action", ["kind", "quantity", "face", "probability"])
+Analysis = namedtuple("Analysis", ["bid_q", "bid_f", "result", "grid", "actions"])
+
+DUDO = "dudo"
+RAISE = "raise"
+CALZA = "calza"
+
+def lowest_raise(bid_q, bid_f, face, rules=STANDARD):
+    # bid_q of None means nothing has been bid yet; None back means face
+    # can't be bid. The raise order itself lives in the rules.
+    return rules.lowest_raise(bid_q, bid_f, face)
+
+def legal_raises(bid_q, bid_f, total_dice, rules=STANDARD):
+    raises = []
+    for face in range(1, 7):
+        lowest = rules.lowest_raise(bid_q, bid_f, face)
+        if lowest is None:
+            continue
+        for quantity in range(lowest, total_dice + 1):
+            raises.append((quantity, face))
+    return raises
+
+def bid_probability(total_dice, known_dice, bid_q, bid_f, uncertain_dice=(), inferred=None,
+                    rules=STANDARD, exact=False):
+    # One cell of score_bid_grid; exact for the chance a calza is right
+    if bid_q > total_dice:
+        return 0.0
+    groups = inferred[bid_f] if inferred else ()
+    unknown_dice = total_dice - len(known_dice) - len(uncertain_dice) - sum(len(dist) - 1 for dist in groups)
+    probabilities = [die_success_probability(die, bid_f, rules) for die in uncertain_dice]
+    return calculate_uncertain_probability(count_successes(known_dice, bid_f, rules), probabilities,
+                                           unknown_dice, bid_f, bid_q, groups, rules, exact)
+
+def calza_action(total_dice, known_dice, bid_q, bid_f, uncertain_dice=(), inferred=None, rules=STANDARD):
+    probability = bid_probability(total_dice, known_dice, bid_q, bid_f, uncertain_dice, inferred, rules, exact=True)
+    return Action(CALZA, bid_q, bid_f, probability)
+
+def action_rank(action):
+    # Best chance first; on ties prefer calling, then the smallest raise
+    return (-action.probability, action.kind != DUDO, action.quantity, action.face)
+
+def best_action(total_dice, known_dice, bid_q, bid_f, uncertain_dice=(), inferred=None, rules=STANDARD,
+                calls=True):
+    # Same answer as recommend_actions(...)[0] without scoring the whole grid:
+    # a face's chance only falls as the quantity rises, so its lowest legal
+    # quantity is the only raise on that face that can come out on top.
+    # calls=False leaves out dudo and calza, giving the best raise
+    candidates = []
+    if bid_q is not None and calls:
+        bid_true = bid_probability(total_dice, known_dice, bid_q, bid_f, uncertain_dice, inferred, rules) if bid_q > 0 else 1.0
+        candidates.append(Action(DUDO, bid_q, bid_f, 1.0 - bid_true))
+        if rules.calza and bid_q > 0:
+            candidates.append(calza_action(total_dice, known_dice, bid_q, bid_f, uncertain_dice, inferred, rules))
+    for face in range(1, 7):
+        quantity = rules.lowest_raise(bid_q, bid_f, face)
+        if quantity is None or quantity > total_dice:
+            continue
+        probability = bid_probability(total_dice, known_dice, quantity, face, uncertain_dice, inferred, rules)
+        candidates.append(Action(RAISE, quantity, face, probability))
+    return min(candidates, key=action_rank) if candidates else None
+
+def recommend_actions(total_dice, known_dice, bid_q, bid_f, uncertain_dice=(), limit=None, inferred=None,
+                      rules=STANDARD):
+    # Ranks calling dudo on the current bid against every legal raise.
+    # Dudo scores the chance the bid is false; a raise scores the chance it holds.
+    if limit == 1:
+        action = best_action(total_dice, known_dice, bid_q, bid_f, uncertain_dice, inferred, rules)
+        return [action] if action else []
+    grid = score_bid_grid(total_dice, known_dice, uncertain_dice, inferred, rules)
+
+    actions = []
+    if bid_q is not None:
+        if bid_q > total_dice:
+            bid_true = 0.0
+        else:
+            bid_true = grid[bid_q - 1][bid_f - 1] if bid_q > 0 else 1.0
+        actions.append(Action(DUDO, bid_q, bid_f, 1.0 - bid_true))
+        if rules.calza and bid_q > 0:
+            actions.append(calza_action(total_dice, known_dice, bid_q, bid_f, uncertain_dice, inferred, rules))
+
+    for quantity, face in legal_raises(bid_q, bid_f, total_dice, rules):
+        actions.append(Action(RAISE, quantity, face, grid[quantity - 1][face - 1]))
+
+    actions.sort(key=action_rank)
+    if limit is not None:
+        return actions[:limit]
+    return actions
+
+def describe_action(action):
+    if action.kind == DUDO:
+        return f"Dudo on {action.quantity} x {action.face}s: {action.probability*100:.1f}% to win"
+    if action.kind == CALZA:
+        return f"Calza on {action.quantity} x {action.face}s: {action.probability*100:.1f}% exactly right"
+    return f"Raise to {action.quantity} x {action.face}s: {action.probability*100:.1f}% to hold"
+
+def split_suspected(your_dice, suspected_dice):
+    # Your dice plus certain suspected faces, and the uncertain suspected dice
+    known = list(your_dice)
+    uncertain = []
+    for dice in suspected_dice:
+        known += [die for die in dice if isinstance(die, int)]
+        uncertain += [die for die in dice if not isinstance(die, int)]
+    return known, uncertain
+
+def analyse_table(total_dice, your_dice, suspected_dice, dice_counts, bid_q, bid_f,
+                  history=None, grid_uses_suspected=False, limit=None, rules=STANDARD, grid=True):
+    # The full picture for one table: the suspected result including inferred
+    # hands, the bid grid (None if grid is off) and the ranked actions.
+    # suspected_dice should leave out opponents covered by history.
+    inferred = None
+    if history is not None and history.inferred_opponents(dice_counts):
+        inferred = {face: list(history.inferred_distributions(face, dice_counts, rules.ones_wild).values())
+                    for face in range(1, 7)}
+
+    result = calculate_probabilities(total_dice, your_dice, suspected_dice, bid_q, bid_f,
+                                     inferred[bid_f] if inferred else (), rules)
+    known, uncertain = split_suspected(your_dice, suspected_dice)
+    if not grid:
+        grid = None
+    elif grid_uses_suspected:
+        grid = score_bid_grid(total_dice, known, uncertain, inferred, rules)
+    else:
+        grid = score_bid_grid(total_dice, your_dice, rules=rules)
+    actions = recommend_actions(total_dice, known, bid_q, bid_f, uncertain, limit, inferred, rules)
+    return Analysis(bid_q, bid_f, result, grid, actions)
@@ -0,0 +1,258 @@
+import argparse
+import json
+import time
+
+from perudo_decision import DUDO, RAISE, Action, legal_raises
+from perudo_engine import success_probability, tail_cache
+from perudo_inference import hand_space
+from perudo_paths import app_path
+
+DEFAULT_TABLE_PATH = app_path("perudo_endgame.json")
+DEFAULT_MAX_DICE = 5
+DUDO_CODE = -1
+
+def bid_rank(bid):
+    # Every legal raise has a higher rank: n ones sit between 2n x 6s and (2n+1) x 2s
+    quantity, face = bid
+    return (2 * quantity, 7) if face == 1 else (quantity, face)
+
+def ordered_bids(total_dice):
+    bids = [(quantity, face) for quantity in range(1, total_dice + 1) for face in range(1, 7)]
+    return sorted(bids, key=bid_rank)
+
+def hand_key(counts):
+    # Sorted faces, e.g. "11346"
+    return "".join(str(face) * count for face, count in zip(range(1, 7), counts))
+
+def counts_from_dice(dice):
+    return tuple(list(dice).count(face) for face in range(1, 7))
+
+class EndgameSolver:
+    # Heads-up positions solved by backward induction. A position (m, o) is
+    # the round opener holding m dice against o. Bids are processed from the
+    # highest rank down, so every raise is valued before any bid below it.
+    # A player facing a bid knows their own hand and holds the prior over the
+    # other hand. They pick the action with the best chance of winning the
+    # game, not just the round, and the reply is the other player's solved
+    # policy averaged over that prior. Values of smaller positions come first,
+    # so losing a die is priced by what the resulting position is worth.
+    def __init__(self):
+        self.values = {}
+        self.tables = {}
+
+    def game_value(self, own_dice, other_dice):
+        # Chance the player opening the round with own_dice wins the game
+        if own_dice <= 0:
+            return 0.0
+        if other_dice <= 0:
+            return 1.0
+        return self.values[(own_dice, other_dice)]
+
+    def solve(self, max_dice=DEFAULT_MAX_DICE, progress=None):
+        pairs = [(m, o) for m in range(1, max_dice + 1) for o in range(m, max_dice + 1)]
+        pairs.sort(key=lambda pair: (pair[0] + pair[1], pair))
+        for m, o in pairs:
+            if (m, o) in self.values and (o, m) in self.values:
+                continue
+            started = time.perf_counter()
+            self.solve_pair(m, o)
+            if progress:
+                progress(m, o, time.perf_counter() - started)
+
+    def round_payoffs(self, own_dice, other_dice):
+        # (game win chance after losing the round, after winning it)
+        lose = self.game_value(own_dice - 1, other_dice) if own_dice > 1 else 0.0
+        win = 1.0 - self.game_value(other_dice - 1, own_dice) if other_dice > 1 else 1.0
+        return lose, win
+
+    def solve_pair(self, m, o):
+        total_dice = m + o
+        bids = ordered_bids(total_dice)
+        index = {bid: i for i, bid in enumerate(bids)}
+        raises_from = [[index[bid] for bid in legal_raises(q, f, total_dice)] for q, f in bids]
+        opening = [index[bid] for bid in legal_raises(None, None, total_dice)]
+
+        keys = [(m, o)] if m == o else [(m, o), (o, m)]
+        space = {key: hand_space(key[0]) for key in keys}
+        payoffs = {key: self.round_payoffs(*key) for key in keys}
+        facing = {key: [None] * len(bids) for key in keys}
+        facing_values = {key: [None] * len(bids) for key in keys}
+        groups = {key: [None] * len(bids) for key in keys}
+        raise_values = {key: [None] * len(bids) for key in keys}
+
+        for j in range(len(bids) - 1, -1, -1):
+            bid_q, bid_f = bids[j]
+            face = bid_f - 1
+            for key in keys:
+                own_dice, other_dice = key
+                hands, priors, supports = space[key]
+                lose, win = payoffs[key]
+                p_success = success_probability(bid_f)
+                codes = []
+                values = []
+                grouped = {}
+                for h in range(len(hands)):
+                    support = supports[face][h]
+                    bid_true = tail_cache.tail(bid_q - support, other_dice, p_success)
+                    best_value = bid_true * lose + (1 - bid_true) * win
+                    best_code = DUDO_CODE
+                    for k in raises_from[j]:
+                        value = raise_values[key][k][h]
+                        if value > best_value:
+                            best_value = value
+                            best_code = k
+                    codes.append(best_code)
+                    values.append(best_value)
+                    group = (best_code, support)
+                    grouped[group] = grouped.get(group, 0.0) + priors[h]
+                facing[key][j] = codes
+                facing_values[key][j] = values
+                groups[key][j] = grouped
+
+            # What raising to bid j is worth, given how the other side answers it
+            for key in keys:
+                other_key = (key[1], key[0])
+                hands, _, supports = space[key]
+                lose, win = payoffs[key]
+                call_by_support = [0.0] * (key[0] + 1)
+                replies = []
+                for (code, other_support), prob in groups[other_key][j].items():
+                    if code == DUDO_CODE:
+                        for support in range(key[0] + 1):
+                            holds = support + other_support >= bid_q
+                            call_by_support[support] += prob * (win if holds else lose)
+                    else:
+                        replies.append((prob, code))
+                values = []
+                for h in range(len(hands)):
+                    value = call_by_support[supports[face][h]]
+                    for prob, code in replies:
+                        value += prob * facing_values[key][code][h]
+                    values.append(value)
+                raise_values[key][j] = values
+
+        for key in keys:
+            hands = space[key][0]
+            open_codes = [max(opening, key=lambda k: raise_values[key][k][h]) for h in range(len(hands))]
+            self.tables[key] = {
+                "bids": bids,
+                "hands": {hand_key(counts): h for h, counts in enumerate(hands)},
+                "opening": open_codes,
+                "facing": [[facing[key][j][h] for j in range(len(bids))] for h in range(len(hands))],
+            }
+
+        # The values above assume the prior over the other hand at every bid.
+        # The stored game values are exact for the solved policies instead,
+        # found by playing every pair of hands through the table.
+        for key in keys:
+            self.values[key] = self.evaluate_position(key, space, bids)
+
+    def evaluate_position(self, key, space, bids):
+        own_dice, other_dice = key
+        other_key = (other_dice, own_dice)
+        own_hands, own_priors, own_supports = space[key]
+        other_hands, other_priors, other_supports = space[other_key]
+        own_table = self.tables[key]
+        other_table = self.tables[other_key]
+
+        opener_loses = 0.0
+        for a in range(len(own_hands)):
+            first_bid = own_table["opening"][a]
+            for b in range(len(other_hands)):
+                code = first_bid
+                # The other player answers the opening bid first
+                answering_other = True
+                while True:
+                    if answering_other:
+                        next_code = other_table["facing"][b][code]
+                    else:
+                        next_code = own_table["facing"][a][code]
+                    if next_code == DUDO_CODE:
+                        break
+                    code = next_code
+                    answering_other = not answering_other
+                bid_q, bid_f = bids[code]
+                holds = own_supports[bid_f - 1][a] + other_supports[bid_f - 1][b] >= bid_q
+                # The caller loses when the bid holds, the bidder otherwise
+                caller_is_other = answering_other
+                if holds != caller_is_other:
+                    opener_loses += own_priors[a] * other_priors[b]
+
+        lose, win = self.round_payoffs(own_dice, other_dice)
+        return opener_loses * lose + (1 - opener_loses) * win
+
+    def best_action(self, your_dice, opponent_dice, bid=None):
+        # Solver move for you holding your_dice against opponent_dice dice,
+        # facing bid (None to open). Returns None outside the solved range.
+        key = (len(your_dice), opponent_dice)
+        table = self.tables.get(key)
+        if table is None:
+            return None
+        h = table["hands"][hand_key(counts_from_dice(your_dice))]
+        bids = table["bids"]
+        if bid is None:
+            code = table["opening"][h]
+            quantity, face = bids[code]
+            return Action(RAISE, quantity, face, None)
+        if bid not in bids:
+            return None
+        code = table["facing"][h][bids.index(tuple(bid))]
+        if code == DUDO_CODE:
+            return Action(DUDO, bid[0], bid[1], None)
+        quantity, face = bids[code]
+        return Action(RAISE, quantity, face, None)
+
+    def save(self, path=DEFAULT_TABLE_PATH):
+        data = {
+            "values": {f"{m},{o}": value for (m, o), value in self.values.items()},
+            "tables": {f"{m},{o}": {"bids": table["bids"], "hands": table["hands"],
+                                    "opening": table["opening"], "facing": table["facing"]}
+                       for (m, o), table in self.tables.items()},
+        }
+        with open(path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path=DEFAULT_TABLE_PATH):
+        with open(path) as f:
+            data = json.load(f)
+        solver = cls()
+        for key, value in data["values"].items():
+            m, o = (int(part) for part in key.split(","))
+            solver.values[(m, o)] = value
+        for key, table in data["tables"].items():
+            m, o = (int(part) for part in key.split(","))
+            table["bids"] = [tuple(bid) for bid in table["bids"]]
+            solver.tables[(m, o)] = table
+        return solver
+
+class EndgamePolicy:
+    # perudo_sim policy that plays the solved table in heads-up positions
+    # and falls back to another policy everywhere else
+    def __init__(self, solver, fallback):
+        self.solver = solver
+        self.fallback = fallback
+
+    def __call__(self, view):
+        alive = [count for count in view.dice_counts if count > 0]
+        if len(alive) == 2:
+            opponent_dice = sum(view.dice_counts) - len(view.hand)
+            action = self.solver.best_action(list(view.hand), opponent_dice, view.bid)
+            if action is not None:
+                return action
+        return self.fallback(view)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve heads-up Perudo endgames and save the table")
+    parser.add_argument("--max-dice", type=int, default=DEFAULT_MAX_DICE)
+    parser.add_argument("--output", default=DEFAULT_TABLE_PATH)
+    args = parser.parse_args(argv)
+
+    solver = EndgameSolver()
+    solver.solve(args.max_dice, progress=lambda m, o, seconds: print(f"Solved {m}v{o} in {seconds:.1f}s"))
+    solver.save(args.output)
+    for m in range(1, args.max_dice + 1):
+        print(" ".join(f"{solver.game_value(m, o):.3f}" for o in range(1, args.max_dice + 1)))
+
+if __name__ == "__main__":
+    main()
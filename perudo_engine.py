@@ -0,0 +1,328 @@
+import math
+import threading
+from collections import OrderedDict, namedtuple
+
+from perudo_rules import STANDARD
+
+# Tables are small; room for a few variants prewarmed side by side
+TAIL_CACHE_SIZE = 1024
+# Above this many unknown dice single queries skip the O(n) table build
+LARGE_TABLE_DICE = 2000
+BETA_MAX_ITERATIONS = 10000
+BETA_EPSILON = 1e-15
+STANDARD_VARIANT = STANDARD.name
+
+ProbabilityResult = namedtuple("ProbabilityResult", [
+    "base_prob", "known_successes", "unknown_dice",
+    "suspected_prob", "suspected_successes", "suspected_dice", "suspected_unknown_dice",
+    "inferred_dice",
+])
+
+def binomial_coefficient(n, k):
+    if k < 0 or k > n:
+        return 0
+    if k == 0 or k == n:
+        return 1
+    k = min(k, n - k)
+    c = 1
+    for i in range(k):
+        c = c * (n - i) // (i + 1)
+    return c
+
+def log_binomial_probability(n, p, k):
+    return (math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
+            + k * math.log(p) + (n - k) * math.log1p(-p))
+
+def calculate_binomial_probability(n, p, k):
+    # Log space, so huge n cannot overflow the coefficient into a float
+    if k < 0 or k > n:
+        return 0.0
+    if p <= 0.0:
+        return 1.0 if k == 0 else 0.0
+    if p >= 1.0:
+        return 1.0 if k == n else 0.0
+    return math.exp(log_binomial_probability(n, p, k))
+
+def beta_continued_fraction(a, b, x):
+    # Lentz's method for the continued fraction of the incomplete beta function
+    tiny = 1e-300
+    c = 1.0
+    d = 1.0 - (a + b) * x / (a + 1)
+    if abs(d) < tiny:
+        d = tiny
+    d = 1.0 / d
+    result = d
+    for m in range(1, BETA_MAX_ITERATIONS + 1):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((a + m2 - 1) * (a + m2))
+        d = 1.0 + aa * d
+        d = tiny if abs(d) < tiny else d
+        c = 1.0 + aa / c
+        c = tiny if abs(c) < tiny else c
+        d = 1.0 / d
+        result *= d * c
+        aa = -(a + m) * (a + b + m) * x / ((a + m2) * (a + m2 + 1))
+        d = 1.0 + aa * d
+        d = tiny if abs(d) < tiny else d
+        c = 1.0 + aa / c
+        c = tiny if abs(c) < tiny else c
+        d = 1.0 / d
+        delta = d * c
+        result *= delta
+        if abs(delta - 1.0) < BETA_EPSILON:
+            break
+    return result
+
+def regularized_incomplete_beta(a, b, x):
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    log_front = (math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+                 + a * math.log(x) + b * math.log1p(-x))
+    # Use whichever side of the fraction converges quickly
+    if x < (a + 1) / (a + b + 2):
+        return math.exp(log_front) * beta_continued_fraction(a, b, x) / a
+    return 1.0 - math.exp(log_front) * beta_continued_fraction(b, a, 1.0 - x) / b
+
+def binomial_tail(n, p, k):
+    # P(X >= k) for X ~ Binomial(n, p) without building a table
+    if k <= 0:
+        return 1.0
+    if k > n:
+        return 0.0
+    return min(max(regularized_incomplete_beta(k, n - k + 1, p), 0.0), 1.0)
+
+def build_tail_table(n, p):
+    # table[k] = P(X >= k) for X ~ Binomial(n, p), k = 0..n+1
+    pmf = [0.0] * (n + 1)
+    if p <= 0.0 or p >= 1.0:
+        pmf[n if p >= 1.0 else 0] = 1.0
+    else:
+        # Start at the mode in log space and walk outwards, so neither end
+        # underflows to zero before the mass near the mode is reached
+        mode = min(n, int((n + 1) * p))
+        pmf[mode] = math.exp(log_binomial_probability(n, p, mode))
+        ratio = p / (1 - p)
+        for k in range(mode, n):
+            pmf[k + 1] = pmf[k] * (n - k) / (k + 1) * ratio
+        for k in range(mode, 0, -1):
+            pmf[k - 1] = pmf[k] * k / (n - k + 1) / ratio
+
+    table = [0.0] * (n + 2)
+    running = 0.0
+    # Sum from the top so small tails keep their precision
+    for k in range(n, -1, -1):
+        running += pmf[k]
+        table[k] = min(running, 1.0)
+    table[0] = 1.0
+    return table
+
+class TailTableCache:
+    def __init__(self, max_tables=TAIL_CACHE_SIZE):
+        self.max_tables = max_tables
+        self.tables = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # The GUI's background worker shares the cache with the Tk thread
+        self.lock = threading.Lock()
+
+    def get_table(self, unknown_dice, p_success, variant=STANDARD_VARIANT):
+        key = (unknown_dice, p_success, variant)
+        with self.lock:
+            table = self.tables.get(key)
+            if table is not None:
+                self.tables.move_to_end(key)
+                self.hits += 1
+                return table
+            self.misses += 1
+
+        table = build_tail_table(unknown_dice, p_success)
+        with self.lock:
+            self.tables[key] = table
+            if len(self.tables) > self.max_tables:
+                self.tables.popitem(last=False)
+        return table
+
+    def tail(self, required, unknown_dice, p_success, variant=STANDARD_VARIANT):
+        if required <= 0:
+            return 1.0
+        if required > unknown_dice:
+            return 0.0
+        if unknown_dice > LARGE_TABLE_DICE and (unknown_dice, p_success, variant) not in self.tables:
+            return binomial_tail(unknown_dice, p_success, required)
+        return self.get_table(unknown_dice, p_success, variant)[required]
+
+    def prewarm(self, max_dice, probabilities=(1/6, 1/3), variant=STANDARD_VARIANT):
+        for unknown_dice in range(1, max_dice + 1):
+            for p_success in probabilities:
+                self.get_table(unknown_dice, p_success, variant)
+
+    def clear(self):
+        with self.lock:
+            self.tables.clear()
+            self.hits = 0
+            self.misses = 0
+
+tail_cache = TailTableCache()
+
+def prewarm_tail_tables(max_dice=60, rules=STANDARD):
+    probabilities = sorted({rules.success_probability(face) for face in range(1, 7)})
+    tail_cache.prewarm(max_dice, probabilities, rules.name)
+
+# Standard rules; the Rules methods cover every variant
+def success_probability(bid_f):
+    return 1/6 if bid_f == 1 else 1/3
+
+def is_success(face, bid_f):
+    return face == bid_f or (face == 1 and bid_f != 1)
+
+def count_successes(faces, bid_f, rules=STANDARD):
+    return sum(1 for face in faces if rules.is_success(face, bid_f))
+
+def calculate_cumulative_probability(known_successes, unknown_dice, bid_f, bid_q, rules=STANDARD):
+    required_unknown = max(0, bid_q - known_successes)
+
+    if unknown_dice <= 0:
+        if required_unknown <= 0:
+            return 1.0
+        else:
+            return 0.0
+    else:
+        p_success = rules.success_probability(bid_f)
+
+        return tail_cache.tail(required_unknown, unknown_dice, p_success, rules.name)
+
+def calculate_exact_probability(known_successes, unknown_dice, bid_f, bid_q, rules=STANDARD):
+    # Chance of exactly bid_q successes, for calza calls; read off the same
+    # cached tail table as the cumulative probability
+    required_unknown = bid_q - known_successes
+    if required_unknown < 0 or required_unknown > max(unknown_dice, 0):
+        return 0.0
+    if unknown_dice <= 0:
+        return 1.0
+    p_success = rules.success_probability(bid_f)
+    if unknown_dice > LARGE_TABLE_DICE and (unknown_dice, p_success, rules.name) not in tail_cache.tables:
+        return calculate_binomial_probability(unknown_dice, p_success, required_unknown)
+    table = tail_cache.get_table(unknown_dice, p_success, rules.name)
+    return max(table[required_unknown] - table[required_unknown + 1], 0.0)
+
+def die_success_probability(die, bid_f, rules=STANDARD):
+    # die is a face (certain), a (face, confidence) pair where the rest of
+    # the confidence is spread as a fair roll, or a {face: weight} distribution
+    if isinstance(die, int):
+        return 1.0 if rules.is_success(die, bid_f) else 0.0
+    if isinstance(die, dict):
+        total = sum(die.values())
+        return sum(weight for face, weight in die.items() if rules.is_success(face, bid_f)) / total
+    face, confidence = die
+    matched = 1.0 if rules.is_success(face, bid_f) else 0.0
+    return confidence * matched + (1 - confidence) * rules.success_probability(bid_f)
+
+def success_count_distribution(probabilities):
+    # Exact Poisson-binomial distribution: dist[k] = P(k of the dice succeed)
+    dist = [1.0]
+    for p in probabilities:
+        q = 1 - p
+        dist = [a * q + b * p for a, b in zip(dist + [0.0], [0.0] + dist)]
+    return dist
+
+def convolve_distributions(a, b):
+    result = [0.0] * (len(a) + len(b) - 1)
+    for i, mass_a in enumerate(a):
+        if mass_a == 0.0:
+            continue
+        for j, mass_b in enumerate(b):
+            result[i + j] += mass_a * mass_b
+    return result
+
+def calculate_uncertain_probability(known_successes, die_probabilities, unknown_dice, bid_f, bid_q, distributions=(),
+                                    rules=STANDARD, exact=False):
+    # Bid probability when some dice only have a success probability, and
+    # some groups of dice come with a whole success-count distribution.
+    # exact gives the chance of exactly bid_q instead of at least bid_q
+    probability = calculate_exact_probability if exact else calculate_cumulative_probability
+    if not die_probabilities and not distributions:
+        return probability(known_successes, unknown_dice, bid_f, bid_q, rules)
+
+    dist = success_count_distribution(die_probabilities)
+    for group in distributions:
+        dist = convolve_distributions(dist, group)
+    prob = 0.0
+    for extra, mass in enumerate(dist):
+        if mass > 0.0:
+            prob += mass * probability(known_successes + extra, unknown_dice, bid_f, bid_q, rules)
+    return min(prob, 1.0)
+
+def calculate_probabilities(total_dice, your_dice, suspected_dice, bid_q, bid_f, inferred=(), rules=STANDARD):
+    # your_dice: faces of your own dice (blank dice left out)
+    # suspected_dice: one list of suspected dice per opponent, already
+    # limited to that opponent's dice count; each entry is anything
+    # die_success_probability accepts. None skips the suspected result
+    # inferred: success-count distributions for bid_f, one per opponent
+    # whose hand is inferred instead of suspected (len = dice + 1)
+    if total_dice <= 0:
+        raise ValueError("Invalid dice count")
+
+    your_dice_count = len(your_dice)
+    known_successes = count_successes(your_dice, bid_f, rules)
+    base_unknown_dice = total_dice - your_dice_count
+    base_prob = calculate_cumulative_probability(known_successes, base_unknown_dice, bid_f, bid_q, rules)
+
+    if suspected_dice is None:
+        return ProbabilityResult(base_prob, known_successes, base_unknown_dice,
+                                 None, None, None, None, None)
+
+    suspected_successes = known_successes
+    suspected_count = 0
+    uncertain = []
+    for dice in suspected_dice:
+        suspected_count += len(dice)
+        for die in dice:
+            if isinstance(die, int):
+                suspected_successes += rules.is_success(die, bid_f)
+            else:
+                uncertain.append(die_success_probability(die, bid_f, rules))
+
+    inferred_count = sum(len(dist) - 1 for dist in inferred)
+    suspected_unknown_dice = base_unknown_dice - suspected_count - inferred_count
+    suspected_prob = calculate_uncertain_probability(suspected_successes, uncertain, suspected_unknown_dice,
+                                                     bid_f, bid_q, inferred, rules)
+
+    return ProbabilityResult(base_prob, known_successes, base_unknown_dice,
+                             suspected_prob, suspected_successes, suspected_count, suspected_unknown_dice,
+                             inferred_count)
+
+def score_bid_grid(total_dice, known_dice, uncertain_dice=(), inferred=None, rules=STANDARD):
+    # grid[q-1][f-1] = probability that bid (q, f) holds, q = 1..total_dice,
+    # treating known_dice as seen, uncertain_dice as suspected dice with a
+    # confidence or face distribution, and the rest of the table as unknown.
+    # inferred maps each face to success-count distributions of inferred hands
+    inferred_count = sum(len(dist) - 1 for dist in inferred[1]) if inferred else 0
+    unknown_dice = total_dice - len(known_dice) - len(uncertain_dice) - inferred_count
+    columns = []
+    for bid_f in range(1, 7):
+        known_successes = count_successes(known_dice, bid_f, rules)
+        if unknown_dice > 0:
+            table = tail_cache.get_table(unknown_dice, rules.success_probability(bid_f), rules.name)
+        else:
+            table = [1.0]
+        column = []
+        for bid_q in range(1, total_dice + 1):
+            required_unknown = bid_q - known_successes
+            if required_unknown <= 0:
+                column.append(1.0)
+            elif required_unknown > unknown_dice:
+                column.append(0.0)
+            else:
+                column.append(table[required_unknown])
+        if uncertain_dice or inferred_count:
+            dist = success_count_distribution([die_success_probability(die, bid_f, rules) for die in uncertain_dice])
+            for group in (inferred[bid_f] if inferred_count else ()):
+                dist = convolve_distributions(dist, group)
+            # Mix the shifted tail columns by how many uncertain dice succeed
+            column = [min(1.0, sum(mass * (column[bid_q - extra - 1] if bid_q - extra > 0 else 1.0)
+                                   for extra, mass in enumerate(dist)))
+                      for bid_q in range(1, total_dice + 1)]
+        columns.append(column)
+    return [list(row) for row in zip(*columns)]
@@ -0,0 +1,201 @@
+import math
+from functools import lru_cache
+
+from perudo_rules import STANDARD
+
+FACES = range(1, 7)
+
+class BiddingModel:
+    # How a player's hand shapes the bid they make. With probability
+    # bluff_rate the face is picked blind; otherwise faces are chosen in
+    # proportion to how many of the player's dice support them
+    # (+ support_prior). The quantity is anything up to what the bidder can
+    # expect on the table, falling off past it over the spread of the other
+    # dice's count plus quantity_spread. An honest bidder expects their
+    # support plus their share of the other dice; a blind one only the
+    # table's average.
+    def __init__(self, bluff_rate=0.25, support_prior=0.5, quantity_spread=1.0):
+        self.bluff_rate = bluff_rate
+        self.support_prior = support_prior
+        self.quantity_spread = quantity_spread
+
+    def key(self):
+        return (self.bluff_rate, self.support_prior, self.quantity_spread)
+
+    def quantity_likelihoods(self, bid_q, lowest, total_dice, dice_count, p):
+        # [P(bid_q | support s) for s = 0..dice_count] for an honest bidder,
+        # and P(bid_q) for a blind one, over the legal quantities
+        # lowest..total_dice
+        lowest = min(lowest, bid_q)
+        total_dice = max(total_dice, bid_q)
+        others = total_dice - dice_count
+        spread = math.sqrt(max(others, 0) * p * (1 - p)) + self.quantity_spread
+
+        def weight(q, expected):
+            return 1.0 if q <= expected else math.exp(-((q - expected) / spread) ** 2 / 2)
+
+        def chance(expected):
+            return weight(bid_q, expected) / sum(weight(q, expected) for q in range(lowest, total_dice + 1))
+
+        return [chance(support + others * p) for support in range(dice_count + 1)], chance(total_dice * p)
+
+    def likelihood(self, supports, bid_f, honest_quantity=1.0, blind_quantity=1.0):
+        honest_total = sum(supports[face - 1] + self.support_prior for face in FACES)
+        honest = (supports[bid_f - 1] + self.support_prior) / honest_total
+        return self.bluff_rate / 6 * blind_quantity + (1 - self.bluff_rate) * honest * honest_quantity
+
+@lru_cache(maxsize=None)
+def hand_space(dice_count, ones_wild=True):
+    # Every hand as face counts (c1..c6), its prior probability, and for each
+    # face how many of its dice would count towards a bid on that face
+    hands = []
+    priors = []
+
+    def compositions(remaining, faces_left):
+        if faces_left == 1:
+            yield (remaining,)
+            return
+        for count in range(remaining + 1):
+            for rest in compositions(remaining - count, faces_left - 1):
+                yield (count,) + rest
+
+    log_total = dice_count * math.log(6)
+    for counts in compositions(dice_count, 6):
+        hands.append(counts)
+        log_weight = math.lgamma(dice_count + 1) - sum(math.lgamma(c + 1) for c in counts) - log_total
+        priors.append(math.exp(log_weight))
+
+    rules = STANDARD._replace(ones_wild=ones_wild)
+    supports = []
+    for bid_f in FACES:
+        supports.append([sum(count for face, count in zip(FACES, counts) if rules.is_success(face, bid_f))
+                         for counts in hands])
+    return hands, priors, supports
+
+@lru_cache(maxsize=256)
+def bid_likelihoods(dice_count, bid_q, bid_f, total_dice, lowest, model_key, rules=STANDARD):
+    # Likelihood of the bid for every hand; without total_dice only the face
+    # is used
+    model = BiddingModel(*model_key)
+    hands, _, supports = hand_space(dice_count, rules.ones_wild)
+    if total_dice is None:
+        honest, blind = [1.0] * (dice_count + 1), 1.0
+    else:
+        honest, blind = model.quantity_likelihoods(bid_q, lowest, total_dice, dice_count,
+                                                   rules.success_probability(bid_f))
+    return [model.likelihood([supports[face - 1][i] for face in FACES], bid_f,
+                             honest[supports[bid_f - 1][i]], blind)
+            for i in range(len(hands))]
+
+class HandPosterior:
+    # Posterior over one opponent's hidden hand, updated one bid at a time
+    def __init__(self, dice_count, model=None, rules=STANDARD):
+        self.dice_count = dice_count
+        self.model = model or BiddingModel()
+        self.rules = rules
+        _, priors, _ = hand_space(dice_count)
+        self.weights = list(priors)
+        self.bids = []
+        self.distribution_cache = {}
+
+    def copy(self):
+        posterior = HandPosterior.__new__(HandPosterior)
+        posterior.dice_count = self.dice_count
+        posterior.model = self.model
+        posterior.rules = self.rules
+        posterior.weights = list(self.weights)
+        posterior.bids = list(self.bids)
+        posterior.distribution_cache = dict(self.distribution_cache)
+        return posterior
+
+    def observe_bid(self, bid_q, bid_f, total_dice=None, previous=None):
+        # previous is the bid this one raised, (quantity, face) or None
+        lowest = self.rules.lowest_raise(*(previous or (None, None)), bid_f) or 1
+        likelihoods = bid_likelihoods(self.dice_count, bid_q, bid_f, total_dice, lowest, self.model.key(), self.rules)
+        weights = [w * l for w, l in zip(self.weights, likelihoods)]
+        total = sum(weights)
+        self.weights = [w / total for w in weights]
+        self.bids.append((bid_q, bid_f))
+        self.distribution_cache.clear()
+
+    def support_distribution(self, bid_f, ones_wild=True):
+        # dist[k] = posterior probability that k of the dice count towards bid_f
+        dist = self.distribution_cache.get((bid_f, ones_wild))
+        if dist is None:
+            _, _, supports = hand_space(self.dice_count, ones_wild)
+            dist = [0.0] * (self.dice_count + 1)
+            for weight, support in zip(self.weights, supports[bid_f - 1]):
+                dist[support] += weight
+            self.distribution_cache[(bid_f, ones_wild)] = dist
+        return dist
+
+    def expected_counts(self):
+        hands, _, _ = hand_space(self.dice_count)
+        expected = [0.0] * 6
+        for weight, counts in zip(self.weights, hands):
+            for i, count in enumerate(counts):
+                expected[i] += weight * count
+        return expected
+
+class BidHistory:
+    # Bids seen this round and the hand posterior of every opponent who bid
+    def __init__(self, model=None):
+        self.model = model or BiddingModel()
+        self.bids = []
+        # (total dice, rules) of every bid, for replays
+        self.contexts = []
+        self.posteriors = {}
+        self.models = {}
+
+    def set_model(self, opponent, model):
+        # Per-opponent bidding model, e.g. from that player's history
+        self.models[opponent] = model
+
+    def record_bid(self, opponent, dice_count, bid_q, bid_f, total_dice=None, rules=STANDARD):
+        # opponent is None for your own bids, which only go in the log.
+        # total_dice lets the quantity count as evidence too
+        previous = self.bids[-1][1:] if self.bids else None
+        self.bids.append((opponent, bid_q, bid_f))
+        self.contexts.append((total_dice, rules))
+        if opponent is None:
+            return
+        posterior = self.posteriors.get(opponent)
+        if posterior is None or posterior.dice_count != dice_count or posterior.rules != rules:
+            # A changed dice count means a new hand, so its evidence starts
+            # over; so does a change of rules
+            posterior = HandPosterior(dice_count, self.models.get(opponent, self.model), rules)
+            self.posteriors[opponent] = posterior
+        posterior.observe_bid(bid_q, bid_f, total_dice, previous)
+
+    def undo_last(self):
+        # Replays the rest of the round; only used for corrections
+        bids = self.bids[:-1]
+        contexts = self.contexts[:-1]
+        dice_counts = {opponent: posterior.dice_count for opponent, posterior in self.posteriors.items()}
+        self.clear()
+        for (opponent, bid_q, bid_f), (total_dice, rules) in zip(bids, contexts):
+            self.record_bid(opponent, dice_counts.get(opponent), bid_q, bid_f, total_dice, rules)
+
+    def clear(self):
+        self.bids = []
+        self.contexts = []
+        self.posteriors = {}
+
+    def snapshot(self):
+        # Independent copy that another thread can read while bids come in
+        history = BidHistory(self.model)
+        history.bids = list(self.bids)
+        history.contexts = list(self.contexts)
+        history.models = dict(self.models)
+        history.posteriors = {opponent: posterior.copy() for opponent, posterior in self.posteriors.items()}
+        return history
+
+    def inferred_opponents(self, dice_counts):
+        # Opponents with bids whose dice count still matches their posterior
+        return [opponent for opponent, posterior in self.posteriors.items()
+                if opponent < len(dice_counts) and dice_counts[opponent] == posterior.dice_count]
+
+    def inferred_distributions(self, bid_f, dice_counts, ones_wild=True):
+        # Success-count distributions for bid_f, keyed by opponent
+        return {opponent: self.posteriors[opponent].support_distribution(bid_f, ones_wild)
+                for opponent in self.inferred_opponents(dice_counts)}
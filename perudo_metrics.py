@@ -0,0 +1,126 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+from perudo_paths import app_path
+
+# PERUDO_PROFILE=1 times the GUI hot paths and counts widgets,
+# PERUDO_PROFILE=overlay also shows the numbers in the window.
+# The summary is written to PERUDO_PROFILE_FILE (default perudo_profile.json
+# next to the program) on exit. When the variable is unset the decorators
+# hand back the undecorated functions, so there is nothing left to pay for.
+ENV_VAR = "PERUDO_PROFILE"
+FILE_ENV_VAR = "PERUDO_PROFILE_FILE"
+DEFAULT_DUMP_PATH = app_path("perudo_profile.json")
+SAMPLE_LIMIT = 10000
+PERCENTILES = (50, 90, 99)
+
+SETTING = os.environ.get(ENV_VAR, "").strip().lower()
+ENABLED = SETTING not in ("", "0", "off")
+OVERLAY = SETTING == "overlay"
+
+def percentile(sorted_samples, percent):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(len(sorted_samples) * percent / 100))
+    return sorted_samples[index]
+
+class Metrics:
+    # Call counts and total time for every timed name, percentiles over the
+    # last SAMPLE_LIMIT calls, and plain counters
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.totals = {}
+        self.samples = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.totals[name] = self.totals.get(name, 0.0) + seconds
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=SAMPLE_LIMIT)
+            samples.append(seconds)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self):
+        with self.lock:
+            timings = {}
+            for name, calls in self.calls.items():
+                samples = sorted(self.samples[name])
+                timing = {"calls": calls, "total_ms": self.totals[name] * 1000,
+                          "mean_ms": self.totals[name] / calls * 1000}
+                for percent in PERCENTILES:
+                    timing[f"p{percent}_ms"] = percentile(samples, percent) * 1000
+                timing["max_ms"] = samples[-1] * 1000
+                timings[name] = timing
+            counters = dict(self.counters)
+        return {"uptime_s": time.perf_counter() - self.started, "timings": timings, "counters": counters}
+
+    def format_summary(self):
+        summary = self.summary()
+        lines = [f"{name}: {t['calls']} calls, {t['total_ms']:.0f} ms total, "
+                 f"p50 {t['p50_ms']:.2f} / p99 {t['p99_ms']:.2f} ms"
+                 for name, t in sorted(summary["timings"].items())]
+        lines += [f"{name}: {value}" for name, value in sorted(summary["counters"].items())]
+        return "\n".join(lines) or "No calls yet"
+
+    def dump(self, path=None):
+        path = path or os.environ.get(FILE_ENV_VAR) or DEFAULT_DUMP_PATH
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        print(f"Performance numbers written to {path}", file=sys.stderr)
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.totals.clear()
+            self.samples.clear()
+            self.counters.clear()
+            self.started = time.perf_counter()
+
+metrics = Metrics()
+
+def timed(name=None):
+    # Decorator; a no-op unless profiling is on
+    def decorate(function):
+        if not ENABLED:
+            return function
+        key = name or function.__qualname__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.record(key, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+def count_widgets(widget_class):
+    # Counts every widget created and destroyed through widget_class
+    # (tkinter.BaseWidget covers tk and ttk widgets alike)
+    original_init = widget_class.__init__
+    original_destroy = widget_class.destroy
+
+    def init(self, *args, **kwargs):
+        metrics.count("widgets_created")
+        original_init(self, *args, **kwargs)
+
+    def destroy(self):
+        metrics.count("widgets_destroyed")
+        original_destroy(self)
+
+    widget_class.__init__ = init
+    widget_class.destroy = destroy
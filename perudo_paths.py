@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Files the program keeps (stats, the endgame table, profiles) go next to
+# the script, or next to the .exe in the one-file build, where __file__ is
+# in a temporary folder that is deleted on exit
+APP_DIR = os.path.dirname(sys.executable if getattr(sys, "frozen", False) else os.path.abspath(__file__))
+
+def app_path(name):
+    return os.path.join(APP_DIR, name)
@@ -0,0 +1,348 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_right
+
+from perudo_rules import STANDARD, rules_named
+from perudo_state import GameState
+
+MAGIC = b"PRDO\x01"
+CHECKPOINT_EVERY = 64
+# The GUI records to this file when the variable is set
+RECORD_ENV_VAR = "PERUDO_RECORD"
+
+# Every record is a header (type, ms since the session started, payload
+# length) and a payload. A file holds any number of sessions back to back;
+# each starts with SESSION and then a CHECKPOINT with the whole table.
+# One change to the table can take several records; all but the last have
+# the CONTINUED bit set in their type, so replays only stop between changes.
+RECORD_HEADER = struct.Struct("<BIH")
+CONTINUED = 0x80
+SESSION, CHECKPOINT, OPPONENTS, OPPONENT_DICE, YOUR_DICE, SUSPECTED, BID, BID_RECORDED, UNDO_BID, NEW_ROUND, RULES = range(11)
+EVENT_NAMES = ["session", "checkpoint", "opponents", "opponent_dice", "your_dice", "suspected",
+               "bid", "bid_recorded", "undo_bid", "new_round", "rules"]
+YOU = 255
+
+# SESSION        <d  unix time
+# CHECKPOINT     <H  state length, GameState bytes, then recorded bids
+# OPPONENTS      <B  opponent count, then <H dice count of each added opponent
+# OPPONENT_DICE  <BH opponent, dice count
+# YOUR_DICE      faces, one byte each
+# SUSPECTED      <B  opponent, then (face, confidence %) pairs
+# BID            <HB quantity, face
+# BID_RECORDED   <BHHB bidder (255 for you), their dice count, quantity, face
+# RULES          rule variant name, ascii; follows every checkpoint
+BID_ENTRY = struct.Struct("<BHHB")
+
+def encode_suspected(dice):
+    encoded = bytearray()
+    for die in dice:
+        if isinstance(die, int):
+            encoded += bytes((die, 100))
+        else:
+            face, confidence = die
+            encoded += bytes((face, round(confidence * 100)))
+    return bytes(encoded)
+
+def decode_suspected(data):
+    return [data[i] if data[i + 1] >= 100 else (data[i], data[i + 1] / 100) for i in range(0, len(data), 2)]
+
+class TableReplay:
+    # The inputs as replay rebuilds them, one event at a time
+    def __init__(self):
+        self.your_dice = []
+        self.opponent_dice = []
+        self.suspected_dice = []
+        self.bid = (1, 1)
+        self.bids = []
+        self.rules = STANDARD
+
+    def load_checkpoint(self, payload):
+        length = struct.unpack_from("<H", payload)[0]
+        state = GameState(payload[2:2 + length])
+        self.your_dice = list(state.your_dice)
+        self.opponent_dice = list(state.opponent_dice)
+        self.suspected_dice = state.suspected_dice
+        self.bid = (state.bid_q, state.bid_f)
+        self.bids = [BID_ENTRY.unpack_from(payload, offset)
+                     for offset in range(2 + length, len(payload), BID_ENTRY.size)]
+
+    def apply(self, kind, payload):
+        if kind == CHECKPOINT:
+            self.load_checkpoint(payload)
+        elif kind == OPPONENTS:
+            count = payload[0]
+            del self.opponent_dice[count:]
+            del self.suspected_dice[count:]
+            added = struct.unpack_from(f"<{count - len(self.opponent_dice)}H", payload, 1) if count > len(self.opponent_dice) else ()
+            self.opponent_dice += added
+            self.suspected_dice += [[] for _ in added]
+        elif kind == OPPONENT_DICE:
+            opponent, count = struct.unpack("<BH", payload)
+            self.opponent_dice[opponent] = count
+        elif kind == YOUR_DICE:
+            self.your_dice = list(payload)
+        elif kind == SUSPECTED:
+            self.suspected_dice[payload[0]] = decode_suspected(payload[1:])
+        elif kind == BID:
+            self.bid = struct.unpack("<HB", payload)
+        elif kind == BID_RECORDED:
+            self.bids.append(BID_ENTRY.unpack(payload))
+        elif kind == UNDO_BID:
+            if self.bids:
+                self.bids.pop()
+        elif kind == NEW_ROUND:
+            self.bids = []
+        elif kind == RULES:
+            self.rules = rules_named(payload.decode("ascii"))
+
+    def state(self):
+        return GameState.from_values(self.your_dice, self.opponent_dice, self.suspected_dice, *self.bid)
+
+    def recorded_bids(self):
+        # (opponent or None for you, dice count, quantity, face)
+        return [(None if bidder == YOU else bidder, dice_count, bid_q, bid_f)
+                for bidder, dice_count, bid_q, bid_f in self.bids]
+
+class SessionRecorder:
+    # Appends the table's changes to path. The GUI hands over every state it
+    # calculates and only the parts that changed are written, so a session
+    # costs a few bytes per edit; writes are buffered by the file object.
+    def __init__(self, path, checkpoint_every=CHECKPOINT_EVERY):
+        self.file = open(path, "ab")
+        self.checkpoint_every = checkpoint_every
+        self.table = None
+        self.state = None
+        self.started = None
+        self.since_checkpoint = 0
+        self.events = 0
+
+    def write(self, kind, payload=b"", continued=False):
+        ms = int((time.monotonic() - self.started) * 1000)
+        self.file.write(RECORD_HEADER.pack(kind | CONTINUED if continued else kind, ms, len(payload)) + payload)
+        self.events += 1
+        self.since_checkpoint += 1
+
+    def write_group(self, records):
+        for i, (kind, payload) in enumerate(records):
+            self.write(kind, payload, continued=i < len(records) - 1)
+
+    def start_session(self):
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.started = time.monotonic()
+        self.table = None
+        self.write(SESSION, struct.pack("<d", time.time()))
+
+    def checkpoint(self):
+        data = self.state.data
+        self.write_group([(CHECKPOINT, struct.pack("<H", len(data)) + data +
+                           b"".join(BID_ENTRY.pack(*bid) for bid in self.table.bids)),
+                          (RULES, self.table.rules.name.encode("ascii"))])
+        self.since_checkpoint = 0
+        self.file.flush()
+
+    def record_state(self, state, rules=STANDARD):
+        if self.started is None:
+            self.start_session()
+        self.state = state
+        if self.table is None:
+            self.table = TableReplay()
+            self.table.load_checkpoint(struct.pack("<H", len(state.data)) + state.data)
+            self.table.rules = rules
+            self.checkpoint()
+            return
+
+        # Everything that changed since the last call is one group
+        table = self.table
+        records = []
+        opponent_dice = list(state.opponent_dice)
+        suspected_dice = state.suspected_dice
+        if len(opponent_dice) != len(table.opponent_dice):
+            added = opponent_dice[len(table.opponent_dice):]
+            payload = bytes((len(opponent_dice),)) + struct.pack(f"<{len(added)}H", *added)
+            records.append((OPPONENTS, payload))
+            table.apply(OPPONENTS, payload)
+        for opponent, count in enumerate(opponent_dice):
+            if table.opponent_dice[opponent] != count:
+                records.append((OPPONENT_DICE, struct.pack("<BH", opponent, count)))
+                table.opponent_dice[opponent] = count
+            if table.suspected_dice[opponent] != suspected_dice[opponent]:
+                records.append((SUSPECTED, bytes((opponent,)) + encode_suspected(suspected_dice[opponent])))
+                table.suspected_dice[opponent] = suspected_dice[opponent]
+        your_dice = list(state.your_dice)
+        if your_dice != table.your_dice:
+            records.append((YOUR_DICE, bytes(your_dice)))
+            table.your_dice = your_dice
+        bid = (state.bid_q, state.bid_f)
+        if bid != tuple(table.bid):
+            records.append((BID, struct.pack("<HB", *bid)))
+            table.bid = bid
+        if rules != table.rules:
+            records.append((RULES, rules.name.encode("ascii")))
+            table.rules = rules
+        self.write_group(records)
+        self.maybe_checkpoint()
+
+    def record_bid(self, opponent, dice_count, bid_q, bid_f):
+        if self.table is None:
+            return
+        entry = (YOU if opponent is None else opponent, dice_count or 0, bid_q, bid_f)
+        self.write(BID_RECORDED, BID_ENTRY.pack(*entry))
+        self.table.bids.append(entry)
+        self.maybe_checkpoint()
+
+    def undo_bid(self):
+        if self.table is None:
+            return
+        self.write(UNDO_BID)
+        self.table.apply(UNDO_BID, b"")
+
+    def new_round(self):
+        if self.table is None:
+            return
+        self.write(NEW_ROUND)
+        self.table.bids = []
+
+    def maybe_checkpoint(self):
+        if self.since_checkpoint >= self.checkpoint_every:
+            self.checkpoint()
+
+    def close(self):
+        self.file.close()
+
+class Recording:
+    # Read side. The file is memory-mapped and indexed once: record offsets
+    # go in a compact array, and jumping to an event replays from the
+    # nearest checkpoint at or before it
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        if size and self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a Perudo recording")
+        self.offsets = array("Q")
+        self.session_starts = array("I")
+        self.checkpoints = array("I")
+        self.build_index()
+
+    def build_index(self):
+        data = self.data
+        offset = len(MAGIC)
+        end = len(data)
+        while offset + RECORD_HEADER.size <= end:
+            kind, _, length = RECORD_HEADER.unpack_from(data, offset)
+            if offset + RECORD_HEADER.size + length > end:
+                # Cut short by a crash; everything before it is still good
+                break
+            kind &= ~CONTINUED
+            if kind == SESSION:
+                self.session_starts.append(len(self.offsets))
+            elif kind == CHECKPOINT:
+                self.checkpoints.append(len(self.offsets))
+            self.offsets.append(offset)
+            offset += RECORD_HEADER.size + length
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def record(self, index):
+        # (type, ms, payload, whether more records of the same change follow)
+        offset = self.offsets[index]
+        kind, ms, length = RECORD_HEADER.unpack_from(self.data, offset)
+        start = offset + RECORD_HEADER.size
+        return kind & ~CONTINUED, ms, bytes(self.data[start:start + length]), bool(kind & CONTINUED)
+
+    def session_range(self, session):
+        # Record indices [start, end) of one session
+        start = self.session_starts[session]
+        end = self.session_starts[session + 1] if session + 1 < len(self.session_starts) else len(self.offsets)
+        return start, end
+
+    def table_at(self, index):
+        # The table right after the change that record index belongs to,
+        # built from the last checkpoint
+        session = bisect_right(self.session_starts, index) - 1
+        session_start = self.session_starts[session]
+        table = TableReplay()
+        checkpoint = bisect_right(self.checkpoints, index) - 1
+        start = self.checkpoints[checkpoint] if checkpoint >= 0 and self.checkpoints[checkpoint] >= session_start else session_start
+        i = start
+        while i < len(self.offsets):
+            kind, _, payload, continued = self.record(i)
+            table.apply(kind, payload)
+            if i >= index and not continued:
+                break
+            i += 1
+        return table
+
+    def replay(self, session):
+        # Yields (record index, event name, ms, table) after every change;
+        # a change written as several records yields once, at its last
+        # record, named after its first
+        start, end = self.session_range(session)
+        table = TableReplay()
+        first_kind = None
+        for index in range(start, end):
+            kind, ms, payload, continued = self.record(index)
+            table.apply(kind, payload)
+            if first_kind is None:
+                first_kind = kind
+                group_start = index
+            if continued:
+                continue
+            if first_kind not in (SESSION, CHECKPOINT) or group_start == start + 1:
+                yield index, EVENT_NAMES[first_kind], ms, table
+            first_kind = None
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+def rescore(recording, output):
+    # One line per state change, scored by today's engine
+    from perudo_cli import evaluate_record
+    for session in range(len(recording.session_starts)):
+        last_scored = None
+        for index, event, ms, table in recording.replay(session):
+            state = table.state()
+            if (state, table.rules) == last_scored or state.total_dice <= 0:
+                continue
+            last_scored = (state, table.rules)
+            record = evaluate_record(index, state, True, table.rules)
+            record.update(session=session, event=event, ms=ms, rules=table.rules.name)
+            output.write(json.dumps(record) + "\n")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect, replay and re-score recorded Perudo sessions")
+    parser.add_argument("path")
+    parser.add_argument("--at", type=int, help="print the table right after this record index")
+    parser.add_argument("--rescore", action="store_true", help="score every recorded state as JSONL")
+    args = parser.parse_args(argv)
+
+    recording = Recording(args.path)
+    try:
+        if args.at is not None:
+            table = recording.table_at(args.at)
+            print(table.state())
+            print(f"Rules: {table.rules.name}")
+            print(f"Recorded bids: {table.recorded_bids()}")
+        elif args.rescore:
+            rescore(recording, sys.stdout)
+        else:
+            for session in range(len(recording.session_starts)):
+                start, end = recording.session_range(session)
+                _, _, payload, _ = recording.record(start)
+                started = time.strftime("%Y-%m-%d %H:%M", time.localtime(struct.unpack("<d", payload)[0]))
+                print(f"Session {session}: started {started}, records {start}-{end - 1}")
+    finally:
+        recording.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+from collections import namedtuple
+
+# A rule set: which dice count towards a bid, how bids may be raised and
+# whether exact-count (calza) calls are allowed. The name keys the rule set's
+# cached probability tables, so each variant keeps its own.
+class Rules(namedtuple("Rules", ["name", "ones_wild", "halving", "ones_can_open", "fixed_face", "calza"])):
+    __slots__ = ()
+
+    def is_success(self, face, bid_f):
+        return face == bid_f or (self.ones_wild and face == 1 and bid_f != 1)
+
+    def success_probability(self, bid_f):
+        return 1/3 if self.ones_wild and bid_f != 1 else 1/6
+
+    def lowest_raise(self, bid_q, bid_f, face):
+        # Lowest legal quantity on face after bid_q x bid_f (None to open),
+        # or None if face can't be bid at all.
+        # Standard order: more dice, or the same count of a higher face.
+        # With halving, switching to ones may halve the count (rounded up)
+        # and leaving ones needs double plus one.
+        if bid_q is None:
+            return None if face == 1 and not self.ones_can_open else 1
+        if self.fixed_face:
+            return bid_q + 1 if face == bid_f else None
+        if self.halving and bid_f == 1:
+            lowest = bid_q + 1 if face == 1 else bid_q * 2 + 1
+        elif self.halving and face == 1:
+            lowest = (bid_q + 1) // 2
+        else:
+            lowest = bid_q + 1 if face <= bid_f else bid_q
+        return max(lowest, 1)
+
+STANDARD = Rules("standard", ones_wild=True, halving=True, ones_can_open=False, fixed_face=False, calza=False)
+# Standard bidding, and a bid can also be answered by calling it exact
+CALZA = STANDARD._replace(name="calza", calza=True)
+# Ones aren't wild and the face is fixed for the round; the palifico player
+# may open on ones
+PALIFICO = Rules("palifico", ones_wild=False, halving=False, ones_can_open=True, fixed_face=True, calza=False)
+# Ones are an ordinary face
+NO_WILDS = Rules("no_wilds", ones_wild=False, halving=False, ones_can_open=True, fixed_face=False, calza=False)
+
+VARIANTS = {rules.name: rules for rules in (STANDARD, CALZA, PALIFICO, NO_WILDS)}
+
+def rules_named(name):
+    # For names from files and requests
+    if name not in VARIANTS:
+        raise ValueError(f"unknown rules {name!r}; use one of {', '.join(VARIANTS)}")
+    return VARIANTS[name]
@@ -0,0 +1,321 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from perudo_cli import evaluate_record, parse_suspected_die
+from perudo_decision import analyse_table
+from perudo_rules import STANDARD, rules_named
+from perudo_state import STATE_CACHE_SIZE, GameState
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+RECOMMENDATION_COUNT = 5
+MAX_BODY = 1 << 20
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large"}
+
+# One process, many tables. Every table is a session holding a GameState;
+# clients send state changes and get the new probabilities back, and every
+# WebSocket watching that table gets them pushed as well.
+#
+#   GET    /tables                 table ids
+#   GET    /tables/<id>            current state and result (?detail=full adds the grid and top actions)
+#   POST   /tables/<id>            apply a change, e.g. {"your_dice": [1, 4], "bid": [3, 4]}
+#   DELETE /tables/<id>            drop the table
+#   GET    /tables/<id>/ws         WebSocket; send changes as text frames, results come back to every watcher
+#   GET    /stats                  request and cache counters
+#
+# A change may hold your_dice, opponent_dice, suspected_dice (one list per
+# opponent, dice as faces or [face, confidence]), bid as [quantity, face],
+# rules (a variant name from perudo_rules), "reset": true to start the
+# table over, and "detail": "full".
+
+class TableSession:
+    def __init__(self, table_id):
+        self.table_id = table_id
+        self.state = GameState.from_values([], [], [], 1, 2)
+        self.rules = STANDARD
+        self.watchers = set()
+        self.version = 0
+
+    def apply(self, change):
+        # The changed fields over the current state, checked as a whole
+        state = GameState.from_values([], [], [], 1, 2) if change.get("reset") else self.state
+        rules = STANDARD if change.get("reset") else self.rules
+        if "rules" in change:
+            rules = rules_named(change["rules"])
+        opponent_dice = change.get("opponent_dice", state.opponent_dice)
+        if "suspected_dice" in change:
+            suspected = [[parse_suspected_die(die) for die in dice] for dice in change["suspected_dice"]]
+        else:
+            # Fewer opponents or dice cut the old guesses down, as in the GUI
+            suspected = [dice[:int(count)] for dice, count in zip(state.suspected_dice, opponent_dice)]
+        bid_q, bid_f = change.get("bid", (state.bid_q, state.bid_f))
+        self.state = GameState.from_input(change.get("your_dice", state.your_dice), opponent_dice,
+                                          suspected, bid_q, bid_f)
+        self.rules = rules
+        self.version += 1
+
+def describe_state(state, rules):
+    return {"your_dice": list(state.your_dice), "opponent_dice": list(state.opponent_dice),
+            "suspected_dice": state.suspected_dice, "bid": [state.bid_q, state.bid_f], "rules": rules.name}
+
+def full_analysis(state, rules):
+    # Runs in the executor; the grid ignores suspected dice, like the GUI default
+    analysis = analyse_table(state.total_dice, list(state.your_dice), state.suspected_dice,
+                             list(state.opponent_dice), state.bid_q, state.bid_f,
+                             limit=RECOMMENDATION_COUNT, rules=rules)
+    return {
+        "grid": analysis.grid,
+        "actions": [{"action": action.kind, "quantity": action.quantity, "face": action.face,
+                     "probability": action.probability} for action in analysis.actions],
+    }
+
+class PerudoService:
+    # Quick results (evaluate_state and the best action) come straight from
+    # the memoized functions every table shares. Full analyses go to the
+    # executor, and are cached here too; tables asking for the same state at
+    # the same time wait on one shared future.
+    def __init__(self, executor=None, cache_size=STATE_CACHE_SIZE):
+        self.executor = executor
+        self.tables = {}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.pending = {}
+        self.requests = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def table(self, table_id, create=False):
+        session = self.tables.get(table_id)
+        if session is None and create:
+            session = TableSession(table_id)
+            self.tables[table_id] = session
+        return session
+
+    async def analyse(self, state, rules):
+        key = (state, rules)
+        analysis = self.cache.get(key)
+        if analysis is not None:
+            self.cache_hits += 1
+            self.cache.move_to_end(key)
+            return analysis
+        future = self.pending.get(key)
+        if future is None:
+            self.cache_misses += 1
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, full_analysis, state, rules)
+            self.pending[key] = future
+            try:
+                analysis = await future
+            finally:
+                del self.pending[key]
+            self.cache[key] = analysis
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return analysis
+        self.cache_hits += 1
+        return await asyncio.shield(future)
+
+    async def snapshot(self, session, detail=False):
+        state = session.state
+        rules = session.rules
+        message = {"table": session.table_id, "version": session.version, "state": describe_state(state, rules)}
+        if state.total_dice <= 0:
+            message["error"] = "no dice on the table"
+            return message
+        message.update(evaluate_record(session.table_id, state, True, rules))
+        message.pop("id")
+        if detail:
+            message.update(await self.analyse(state, rules))
+        return message
+
+    async def change(self, session, change):
+        session.apply(change)
+        message = await self.snapshot(session, change.get("detail") == "full")
+        await self.broadcast(session, message)
+        return message
+
+    async def broadcast(self, session, message):
+        if not session.watchers:
+            return
+        frame = encode_frame(json.dumps(message).encode())
+        for writer in list(session.watchers):
+            try:
+                writer.write(frame)
+                await writer.drain()
+            except ConnectionError:
+                session.watchers.discard(writer)
+
+    def stats(self):
+        return {"tables": len(self.tables), "requests": self.requests,
+                "watchers": sum(len(session.watchers) for session in self.tables.values()),
+                "analysis_cache": {"size": len(self.cache), "hits": self.cache_hits, "misses": self.cache_misses}}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                self.requests += 1
+                path = urlsplit(target).path.rstrip("/")
+                if path.startswith("/tables/") and path.endswith("/ws") and headers.get("upgrade", "").lower() == "websocket":
+                    await self.serve_websocket(path[len("/tables/"):-len("/ws")], headers, reader, writer)
+                    break
+                status, payload = await self.route(method, target, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            write_response(writer, 400, {"error": str(e)}, False)
+        finally:
+            writer.close()
+
+    async def route(self, method, target, body):
+        parts = urlsplit(target)
+        path = [part for part in parts.path.split("/") if part]
+        detail = parse_qs(parts.query).get("detail") == ["full"]
+        if path == ["stats"] and method == "GET":
+            return 200, self.stats()
+        if path == ["tables"] and method == "GET":
+            return 200, {"tables": sorted(self.tables)}
+        if len(path) != 2 or path[0] != "tables":
+            return 404, {"error": "not found"}
+
+        table_id = path[1]
+        if method == "GET":
+            session = self.table(table_id)
+            if session is None:
+                return 404, {"error": f"no table {table_id}"}
+            return 200, await self.snapshot(session, detail)
+        if method == "POST":
+            try:
+                change = json.loads(body or b"{}")
+                if detail:
+                    change["detail"] = "full"
+                return 200, await self.change(self.table(table_id, create=True), change)
+            except (ValueError, KeyError, TypeError, IndexError, AttributeError, struct.error) as e:
+                return 400, {"error": str(e) or type(e).__name__}
+        if method == "DELETE":
+            session = self.tables.pop(table_id, None)
+            if session is None:
+                return 404, {"error": f"no table {table_id}"}
+            for watcher in session.watchers:
+                watcher.close()
+            return 200, {"deleted": table_id}
+        return 405, {"error": "method not allowed"}
+
+    async def serve_websocket(self, table_id, headers, reader, writer):
+        key = headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                      f"Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        session = self.table(table_id, create=True)
+        session.watchers.add(writer)
+        try:
+            writer.write(encode_frame(json.dumps(await self.snapshot(session)).encode()))
+            await writer.drain()
+            while True:
+                opcode, payload = await read_frame(reader)
+                if opcode == 0x8:
+                    writer.write(encode_frame(payload[:2], 0x8))
+                    await writer.drain()
+                    return
+                if opcode == 0x9:
+                    writer.write(encode_frame(payload, 0xA))
+                    await writer.drain()
+                elif opcode == 0x1:
+                    try:
+                        await self.change(session, json.loads(payload))
+                    except (ValueError, KeyError, TypeError, IndexError, AttributeError, struct.error) as e:
+                        writer.write(encode_frame(json.dumps({"error": str(e) or type(e).__name__}).encode()))
+                        await writer.drain()
+        finally:
+            session.watchers.discard(writer)
+
+async def read_request(reader):
+    # Minimal HTTP/1.1: request line, headers, Content-Length body
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    method, target, _ = line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY:
+        raise ValueError("request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, headers, body
+
+def write_response(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload).encode()
+    writer.write((f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                  f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                  f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + body)
+
+async def read_frame(reader):
+    # One client frame: (opcode, unmasked payload). Fragmented messages
+    # aren't supported; browsers don't fragment small text messages
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    if length > MAX_BODY:
+        raise ValueError("frame too large")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return first & 0x0F, payload
+
+def encode_frame(payload, opcode=0x1):
+    # Server frames are never masked
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        service = PerudoService(executor)
+        server = await asyncio.start_server(service.handle_connection, host, port)
+        print(f"Serving Perudo tables on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve Perudo probabilities for many tables over HTTP and WebSocket")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None, help="processes for full analyses (default: all cores)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
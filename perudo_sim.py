@@ -0,0 +1,264 @@
+import argparse
+import math
+import os
+import random
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from perudo_decision import DUDO, RAISE, Action, best_action, legal_raises, lowest_raise, recommend_actions
+from perudo_engine import calculate_probabilities, is_success
+
+SeatView = namedtuple("SeatView", ["seat", "hand", "dice_counts", "bid", "rng"])
+SimulationResult = namedtuple("SimulationResult", ["trials", "counts", "rates", "intervals"])
+
+# randbytes() values 0..251 map evenly onto faces; 252..255 are dropped
+FACE_BYTES = bytes(i % 6 + 1 for i in range(252)) + bytes(4)
+REJECTED_BYTES = bytes(range(252, 256))
+
+GAMES_PER_CHUNK = 100
+ROUNDS_PER_CHUNK = 2000
+TRIALS_PER_CHUNK = 250000
+POLICY_CACHE_SIZE = 1 << 16
+
+def roll_faces(rng, count):
+    # Rolls count dice in one batch; returns a bytes object of faces 1-6
+    faces = b""
+    while len(faces) < count:
+        needed = count - len(faces)
+        # Ask for a little extra so one call almost always covers the rejects
+        data = rng.randbytes(needed + needed // 32 + 8)
+        faces += data.translate(None, REJECTED_BYTES).translate(FACE_BYTES)
+    return faces[:count]
+
+def roll_hands(rng, dice_counts):
+    faces = roll_faces(rng, sum(dice_counts))
+    hands = []
+    start = 0
+    for count in dice_counts:
+        hands.append(faces[start:start + count])
+        start += count
+    return hands
+
+def count_bid(hands, bid_f):
+    total = 0
+    for hand in hands:
+        total += hand.count(bid_f)
+        if bid_f != 1:
+            total += hand.count(1)
+    return total
+
+def wilson_interval(successes, trials, z=1.96):
+    if trials == 0:
+        return (0.0, 1.0)
+    phat = successes / trials
+    denominator = 1 + z * z / trials
+    centre = (phat + z * z / (2 * trials)) / denominator
+    margin = z * math.sqrt(phat * (1 - phat) / trials + z * z / (4 * trials * trials)) / denominator
+    return (max(0.0, centre - margin), min(1.0, centre + margin))
+
+def make_result(counts, trials):
+    rates = [count / trials if trials else 0.0 for count in counts]
+    intervals = [wilson_interval(count, trials) for count in counts]
+    return SimulationResult(trials, counts, rates, intervals)
+
+# Policies take a SeatView and return an Action (probability may be None)
+
+@lru_cache(maxsize=POLICY_CACHE_SIZE)
+def analytic_choice(total_dice, hand, bid):
+    # hand is sorted, so every ordering of the same dice shares an entry
+    bid_q, bid_f = bid if bid else (None, None)
+    return recommend_actions(total_dice, list(hand), bid_q, bid_f, limit=1)[0]
+
+def analytic_policy(view):
+    return analytic_choice(sum(view.dice_counts), bytes(sorted(view.hand)), view.bid)
+
+def random_policy(view):
+    total_dice = sum(view.dice_counts)
+    bid_q, bid_f = view.bid if view.bid else (None, None)
+    raises = legal_raises(bid_q, bid_f, total_dice)
+    if view.bid is not None and (not raises or view.rng.random() < 0.3):
+        return Action(DUDO, bid_q, bid_f, None)
+    quantity, face = view.rng.choice(raises)
+    return Action(RAISE, quantity, face, None)
+
+class ThresholdPolicy:
+    # Calls dudo once the current bid looks less likely than threshold,
+    # otherwise makes the safest raise
+    def __init__(self, threshold=0.5):
+        self.threshold = threshold
+
+    def __call__(self, view):
+        total_dice = sum(view.dice_counts)
+        if view.bid is not None:
+            bid_q, bid_f = view.bid
+            result = calculate_probabilities(total_dice, list(view.hand), None, bid_q, bid_f)
+            if result.base_prob < self.threshold:
+                return Action(DUDO, bid_q, bid_f, 1.0 - result.base_prob)
+        bid_q, bid_f = view.bid if view.bid else (None, None)
+        action = best_action(total_dice, list(view.hand), bid_q, bid_f, calls=False)
+        return action or Action(DUDO, bid_q, bid_f, None)
+
+POLICIES = {
+    "analytic": analytic_policy,
+    "random": random_policy,
+    "cautious": ThresholdPolicy(0.4),
+    "bold": ThresholdPolicy(0.6),
+}
+
+def is_legal_raise(bid_q, bid_f, quantity, face, total_dice):
+    # Same as (quantity, face) in legal_raises(...), without building the list
+    if face not in range(1, 7):
+        return False
+    lowest = lowest_raise(bid_q, bid_f, face)
+    return lowest is not None and lowest <= quantity <= total_dice
+
+def next_active_seat(dice_counts, seat):
+    for step in range(1, len(dice_counts) + 1):
+        candidate = (seat + step) % len(dice_counts)
+        if dice_counts[candidate] > 0:
+            return candidate
+    return seat
+
+def play_round(policies, dice_counts, starting_seat, rng, your_dice=None):
+    # Plays one round and returns the seat that loses a die
+    hands = roll_hands(rng, dice_counts)
+    if your_dice is not None:
+        hands[0] = bytes(your_dice)
+
+    total_dice = sum(dice_counts)
+    seat = starting_seat
+    bid = None
+    bidder = None
+    while True:
+        view = SeatView(seat, hands[seat], dice_counts, bid, rng)
+        action = policies[seat](view)
+        if action.kind == DUDO and bid is not None:
+            if count_bid(hands, bid[1]) >= bid[0]:
+                return seat
+            return bidder
+
+        bid_q, bid_f = bid if bid else (None, None)
+        if not is_legal_raise(bid_q, bid_f, action.quantity, action.face, total_dice):
+            # An illegal or impossible raise loses the round
+            return seat
+        bid = (action.quantity, action.face)
+        bidder = seat
+        seat = next_active_seat(dice_counts, seat)
+
+def play_game(policies, dice_counts, rng, your_dice=None, starting_seat=0):
+    # Plays until one seat has dice left and returns that seat
+    dice_counts = bytearray(dice_counts)
+    seat = starting_seat
+    first_round = True
+    while sum(1 for count in dice_counts if count > 0) > 1:
+        loser = play_round(policies, dice_counts, seat, rng, your_dice if first_round else None)
+        first_round = False
+        dice_counts[loser] -= 1
+        # The loser starts the next round, or the next seat if they are out
+        seat = loser if dice_counts[loser] > 0 else next_active_seat(dice_counts, loser)
+    return next(i for i, count in enumerate(dice_counts) if count > 0)
+
+def chunk_rng(seed, chunk_index):
+    # Seeded per chunk, not per process, so results do not depend on scheduling
+    return random.Random(seed * 1000003 + chunk_index)
+
+def _run_games(policies, dice_counts, games, seed, chunk_index, your_dice):
+    rng = chunk_rng(seed, chunk_index)
+    wins = [0] * len(dice_counts)
+    for _ in range(games):
+        wins[play_game(policies, dice_counts, rng, your_dice)] += 1
+    return wins
+
+def _run_rounds(policies, dice_counts, rounds, seed, chunk_index, your_dice):
+    rng = chunk_rng(seed, chunk_index)
+    losses = [0] * len(dice_counts)
+    for _ in range(rounds):
+        losses[play_round(policies, dice_counts, 0, rng, your_dice)] += 1
+    return losses
+
+def _run_bid_trials(unknown_dice, required, bid_f, trials, seed, chunk_index):
+    rng = chunk_rng(seed, chunk_index)
+    # Map every face to 1 if it counts towards the bid, 0 otherwise
+    success_table = bytes(1 if 1 <= value <= 6 and is_success(value, bid_f) else 0 for value in range(256))
+    hits = 0
+    batch = max(1, 1000000 // max(unknown_dice, 1))
+    done = 0
+    while done < trials:
+        size = min(batch, trials - done)
+        flags = roll_faces(rng, size * unknown_dice).translate(success_table)
+        for start in range(0, size * unknown_dice, unknown_dice):
+            if flags.count(1, start, start + unknown_dice) >= required:
+                hits += 1
+        done += size
+    return hits
+
+def split_work(total, chunk_size):
+    # Fixed-size chunks keep results identical whatever the worker count
+    return [min(chunk_size, total - start) for start in range(0, total, chunk_size)]
+
+def chunk_args(args, size, seed, chunk_index):
+    leading, trailing = args
+    return (*leading, size, seed, chunk_index, *trailing)
+
+def run_chunks(function, sizes, args, seed, workers):
+    # args is (leading, trailing); each chunk is called with
+    # leading + (size, seed, chunk_index) + trailing
+    if workers == 1 or len(sizes) == 1:
+        return [function(*chunk_args(args, size, seed, i)) for i, size in enumerate(sizes)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(function, *chunk_args(args, size, seed, i)) for i, size in enumerate(sizes)]
+        return [future.result() for future in futures]
+
+def resolve_policies(policies):
+    return [POLICIES[policy] if isinstance(policy, str) else policy for policy in policies]
+
+def simulate_games(policies, dice_counts, games, seed=0, workers=None, your_dice=None):
+    # Win rate per seat, with Wilson 95% intervals
+    policies = resolve_policies(policies)
+    workers = workers or os.cpu_count() or 1
+    sizes = split_work(games, GAMES_PER_CHUNK)
+    results = run_chunks(_run_games, sizes, ((policies, list(dice_counts)), (your_dice,)), seed, workers)
+    wins = [sum(seat_wins) for seat_wins in zip(*results)]
+    return make_result(wins, games)
+
+def simulate_rounds(policies, dice_counts, rounds, seed=0, workers=None, your_dice=None):
+    # Chance each seat loses a single round started by seat 0
+    policies = resolve_policies(policies)
+    workers = workers or os.cpu_count() or 1
+    sizes = split_work(rounds, ROUNDS_PER_CHUNK)
+    results = run_chunks(_run_rounds, sizes, ((policies, list(dice_counts)), (your_dice,)), seed, workers)
+    losses = [sum(seat_losses) for seat_losses in zip(*results)]
+    return make_result(losses, rounds)
+
+def estimate_bid_probability(total_dice, your_dice, bid_q, bid_f, trials, seed=0, workers=None):
+    # Monte Carlo counterpart of calculate_probabilities(...).base_prob
+    unknown_dice = total_dice - len(your_dice)
+    required = bid_q - sum(1 for face in your_dice if is_success(face, bid_f))
+    if required <= 0:
+        return make_result([trials], trials)
+    if required > unknown_dice:
+        return make_result([0], trials)
+    workers = workers or os.cpu_count() or 1
+    sizes = split_work(trials, TRIALS_PER_CHUNK)
+    results = run_chunks(_run_bid_trials, sizes, ((unknown_dice, required, bid_f), ()), seed, workers)
+    return make_result([sum(results)], trials)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate Perudo games between policies")
+    parser.add_argument("--policies", default="analytic,random,random,random",
+                        help="comma separated policy per seat: " + ", ".join(POLICIES))
+    parser.add_argument("--dice", type=int, default=5, help="dice per seat")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    policies = args.policies.split(",")
+    result = simulate_games(policies, [args.dice] * len(policies), args.games, args.seed, args.workers)
+    for seat, name in enumerate(policies):
+        low, high = result.intervals[seat]
+        print(f"Seat {seat+1} ({name}): {result.rates[seat]*100:.2f}% wins (95% CI {low*100:.2f}-{high*100:.2f}%)")
+
+if __name__ == "__main__":
+    main()
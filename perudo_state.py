@@ -0,0 +1,158 @@
+import struct
+from functools import lru_cache
+
+from perudo_engine import calculate_probabilities
+from perudo_rules import STANDARD
+
+STATE_CACHE_SIZE = 4096
+
+# bid quantity, bid face, your dice count, opponent count
+HEADER = struct.Struct("<HBBB")
+
+# Checks for values from outside (files, requests); each raises ValueError
+# or returns the values as ints
+
+def validate_faces(dice):
+    faces = [int(face) for face in dice]
+    if any(face < 1 or face > 6 for face in faces):
+        raise ValueError("dice faces must be 1-6")
+    return faces
+
+def validate_counts(counts):
+    counts = [int(count) for count in counts]
+    if any(count < 0 for count in counts):
+        raise ValueError("dice counts can't be negative")
+    return counts
+
+def validate_suspected(suspected_dice, opponent_dice):
+    # Suspected dice per opponent, each a face or (face, confidence); no
+    # more lists than opponents and no more dice than the opponent holds
+    if len(suspected_dice) > len(opponent_dice):
+        raise ValueError("more suspected dice lists than opponents")
+    for dice, count in zip(suspected_dice, opponent_dice):
+        if len(dice) > count:
+            raise ValueError("more suspected dice than the opponent has")
+        for die in dice:
+            face, confidence = (die, 1.0) if isinstance(die, int) else die
+            validate_faces([face])
+            if not 0 <= confidence <= 1:
+                raise ValueError("confidence must be 0-1")
+    return suspected_dice
+
+def validate_bid(bid_q, bid_f):
+    bid_q, bid_f = int(bid_q), int(bid_f)
+    if bid_q < 1 or not 1 <= bid_f <= 6:
+        raise ValueError("bid must be quantity >= 1 and face 1-6")
+    return bid_q, bid_f
+
+class GameState:
+    # Immutable table snapshot packed into a single bytes object:
+    # header, your faces (1 byte each), opponent dice counts (2 bytes each),
+    # then per opponent a suspected count and (face, confidence %) pairs.
+    # Confidence 100 means a certain suspected die.
+    __slots__ = ("data", "hash")
+
+    def __init__(self, data):
+        object.__setattr__(self, "data", bytes(data))
+        object.__setattr__(self, "hash", hash(self.data))
+
+    @classmethod
+    def from_values(cls, your_dice, opponent_dice, suspected_dice, bid_q, bid_f):
+        parts = [HEADER.pack(bid_q, bid_f, len(your_dice), len(opponent_dice)),
+                 bytes(your_dice),
+                 struct.pack(f"<{len(opponent_dice)}H", *opponent_dice)]
+        for opponent in range(len(opponent_dice)):
+            dice = suspected_dice[opponent] if suspected_dice and opponent < len(suspected_dice) else []
+            encoded = bytearray([len(dice)])
+            for die in dice:
+                if isinstance(die, int):
+                    encoded += bytes((die, 100))
+                else:
+                    face, confidence = die
+                    encoded += bytes((face, round(confidence * 100)))
+            parts.append(bytes(encoded))
+        return cls(b"".join(parts))
+
+    @classmethod
+    def from_input(cls, your_dice, opponent_dice, suspected_dice, bid_q, bid_f):
+        # from_values for values that haven't been checked yet
+        opponent_dice = validate_counts(opponent_dice)
+        return cls.from_values(validate_faces(your_dice), opponent_dice,
+                               validate_suspected(suspected_dice, opponent_dice), *validate_bid(bid_q, bid_f))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GameState is immutable")
+
+    def __reduce__(self):
+        return (GameState, (self.data,))
+
+    def __eq__(self, other):
+        return isinstance(other, GameState) and self.data == other.data
+
+    def __hash__(self):
+        return self.hash
+
+    def __repr__(self):
+        return (f"GameState(your_dice={self.your_dice}, opponent_dice={self.opponent_dice}, "
+                f"suspected_dice={self.suspected_dice}, bid=({self.bid_q}, {self.bid_f}))")
+
+    def header(self):
+        return HEADER.unpack_from(self.data)
+
+    @property
+    def bid_q(self):
+        return self.header()[0]
+
+    @property
+    def bid_f(self):
+        return self.header()[1]
+
+    @property
+    def your_dice(self):
+        your_count = self.header()[2]
+        return tuple(self.data[HEADER.size:HEADER.size + your_count])
+
+    @property
+    def opponent_dice(self):
+        _, _, your_count, opponent_count = self.header()
+        return struct.unpack_from(f"<{opponent_count}H", self.data, HEADER.size + your_count)
+
+    @property
+    def suspected_dice(self):
+        _, _, your_count, opponent_count = self.header()
+        offset = HEADER.size + your_count + 2 * opponent_count
+        suspected = []
+        for _ in range(opponent_count):
+            count = self.data[offset]
+            offset += 1
+            dice = []
+            for _ in range(count):
+                face, confidence = self.data[offset], self.data[offset + 1]
+                dice.append(face if confidence >= 100 else (face, confidence / 100))
+                offset += 2
+            suspected.append(dice)
+        return suspected
+
+    @property
+    def total_dice(self):
+        return len(self.your_dice) + sum(self.opponent_dice)
+
+    def replace(self, your_dice=None, opponent_dice=None, suspected_dice=None, bid_q=None, bid_f=None):
+        return GameState.from_values(
+            self.your_dice if your_dice is None else your_dice,
+            self.opponent_dice if opponent_dice is None else opponent_dice,
+            self.suspected_dice if suspected_dice is None else suspected_dice,
+            self.bid_q if bid_q is None else bid_q,
+            self.bid_f if bid_f is None else bid_f)
+
+    def without_suspected(self, opponents):
+        suspected = self.suspected_dice
+        for opponent in opponents:
+            suspected[opponent] = []
+        return self.replace(suspected_dice=suspected)
+
+@lru_cache(maxsize=STATE_CACHE_SIZE)
+def evaluate_state(state, rules=STANDARD):
+    # Memoized calculate_probabilities for a GameState
+    return calculate_probabilities(state.total_dice, list(state.your_dice), state.suspected_dice,
+                                   state.bid_q, state.bid_f, rules=rules)
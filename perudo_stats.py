@@ -0,0 +1,190 @@
+import sqlite3
+import time
+
+from perudo_inference import BiddingModel
+from perudo_paths import app_path
+
+DEFAULT_STATS_PATH = app_path("perudo_stats.sqlite")
+BATCH_SIZE = 200
+# The bluff rate starts at BiddingModel's default, worth this many revealed
+# showdowns
+PRIOR_WEIGHT = 8
+DEFAULT_BLUFF_RATE = BiddingModel().bluff_rate
+
+# Raw events go in bids, showdowns and calls, indexed by player for history
+# queries. player_totals keeps running counts so a prior is one primary-key
+# lookup however many years of rows pile up behind it.
+# A showdown is one of the player's bids being called. It failed if the
+# table held fewer dice than bid; support is how many of the bidder's own
+# dice counted towards it, when that was entered (NULL otherwise).
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS bids (
+    player_id INTEGER NOT NULL REFERENCES players (id),
+    played_at REAL NOT NULL,
+    dice_count INTEGER,
+    bid_q INTEGER NOT NULL,
+    bid_f INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS showdowns (
+    player_id INTEGER NOT NULL REFERENCES players (id),
+    played_at REAL NOT NULL,
+    bid_q INTEGER NOT NULL,
+    bid_f INTEGER NOT NULL,
+    held INTEGER NOT NULL,
+    support INTEGER
+);
+CREATE TABLE IF NOT EXISTS calls (
+    player_id INTEGER NOT NULL REFERENCES players (id),
+    played_at REAL NOT NULL,
+    bid_q INTEGER NOT NULL,
+    bid_f INTEGER NOT NULL,
+    correct INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS player_totals (
+    player_id INTEGER PRIMARY KEY REFERENCES players (id),
+    bids INTEGER NOT NULL,
+    showdowns INTEGER NOT NULL,
+    failed INTEGER NOT NULL,
+    revealed INTEGER NOT NULL,
+    bluffs INTEGER NOT NULL,
+    calls INTEGER NOT NULL,
+    correct_calls INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS bids_by_player_face ON bids (player_id, bid_f);
+CREATE INDEX IF NOT EXISTS showdowns_by_player ON showdowns (player_id, played_at);
+CREATE INDEX IF NOT EXISTS calls_by_player ON calls (player_id, played_at);
+"""
+
+TOTAL_FIELDS = ["bids", "showdowns", "failed", "revealed", "bluffs", "calls", "correct_calls"]
+
+class OpponentStats:
+    # Per-player history across sessions. Writes wait in memory and go in
+    # one transaction every BATCH_SIZE events (or on flush); lookups add the
+    # waiting events to the stored totals. The database opens on first use.
+    def __init__(self, path=DEFAULT_STATS_PATH, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.connection = None
+        self.player_ids = {}
+        self.pending = {"bids": [], "showdowns": [], "calls": []}
+        self.pending_totals = {}
+        self.pending_count = 0
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def player_id(self, name, create=True):
+        player_id = self.player_ids.get(name)
+        if player_id is None:
+            connection = self.connect()
+            if create:
+                connection.execute("INSERT OR IGNORE INTO players (name) VALUES (?)", (name,))
+            row = connection.execute("SELECT id FROM players WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            player_id = self.player_ids[name] = row[0]
+        return player_id
+
+    def add(self, table, name, row, **totals):
+        self.pending[table].append((name, time.time()) + row)
+        pending = self.pending_totals.setdefault(name, dict.fromkeys(TOTAL_FIELDS, 0))
+        for field, amount in totals.items():
+            pending[field] += amount
+        self.pending_count += 1
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def record_bid(self, name, dice_count, bid_q, bid_f):
+        self.add("bids", name, (dice_count, bid_q, bid_f), bids=1)
+
+    def record_showdown(self, name, bid_q, bid_f, held, support=None):
+        # A bid of name's that was called. With support (their own dice
+        # counting towards it) known, a bid with none is a bluff
+        self.add("showdowns", name, (bid_q, bid_f, int(held), support), showdowns=1, failed=0 if held else 1,
+                 revealed=0 if support is None else 1, bluffs=1 if support == 0 else 0)
+
+    def record_call(self, name, bid_q, bid_f, correct):
+        # name called dudo on bid_q x bid_f
+        self.add("calls", name, (bid_q, bid_f, int(correct)), calls=1, correct_calls=1 if correct else 0)
+
+    def flush(self):
+        if not self.pending_count:
+            return
+        connection = self.connect()
+        with connection:
+            for table, rows in self.pending.items():
+                if not rows:
+                    continue
+                placeholders = ", ".join("?" * (len(rows[0])))
+                connection.executemany(f"INSERT INTO {table} VALUES ({placeholders})",
+                                       [(self.player_id(row[0]),) + row[1:] for row in rows])
+            connection.executemany(
+                f"INSERT INTO player_totals (player_id, {', '.join(TOTAL_FIELDS)}) "
+                f"VALUES ({', '.join('?' * (len(TOTAL_FIELDS) + 1))}) ON CONFLICT (player_id) DO UPDATE SET "
+                + ", ".join(f"{field} = {field} + excluded.{field}" for field in TOTAL_FIELDS),
+                [(self.player_id(name),) + tuple(totals[field] for field in TOTAL_FIELDS)
+                 for name, totals in self.pending_totals.items()])
+        self.pending = {table: [] for table in self.pending}
+        self.pending_totals = {}
+        self.pending_count = 0
+
+    def totals(self, name):
+        totals = dict.fromkeys(TOTAL_FIELDS, 0)
+        player_id = self.player_id(name, create=False)
+        if player_id is not None:
+            row = self.connect().execute(
+                f"SELECT {', '.join(TOTAL_FIELDS)} FROM player_totals WHERE player_id = ?", (player_id,)).fetchone()
+            if row:
+                totals = dict(zip(TOTAL_FIELDS, row))
+        for field, amount in self.pending_totals.get(name, {}).items():
+            totals[field] += amount
+        return totals
+
+    def bluff_rate(self, name, default=DEFAULT_BLUFF_RATE):
+        # Share of revealed bids on a face the bidder held none of, which is
+        # what BiddingModel's blind pick stands for. Pulled towards default
+        # until there are a few to go on
+        totals = self.totals(name)
+        return (totals["bluffs"] + default * PRIOR_WEIGHT) / (totals["revealed"] + PRIOR_WEIGHT)
+
+    def failed_call_rate(self, name):
+        # Share of name's called bids that failed on the count. Called bids
+        # are mostly long shots, so honest players fail often too
+        totals = self.totals(name)
+        return totals["failed"] / totals["showdowns"] if totals["showdowns"] else None
+
+    def call_accuracy(self, name):
+        totals = self.totals(name)
+        return totals["correct_calls"] / totals["calls"] if totals["calls"] else None
+
+    def face_tendencies(self, name):
+        # Share of name's bids on each face
+        self.flush()
+        player_id = self.player_id(name, create=False)
+        counts = [0] * 6
+        if player_id is not None:
+            for face, count in self.connect().execute(
+                    "SELECT bid_f, COUNT(*) FROM bids WHERE player_id = ? GROUP BY bid_f", (player_id,)):
+                if 1 <= face <= 6:
+                    counts[face - 1] = count
+        total = sum(counts)
+        return [count / total for count in counts] if total else [1 / 6] * 6
+
+    def model(self, name):
+        # Bidding model for perudo_inference, e.g. BidHistory.set_model
+        return BiddingModel(bluff_rate=self.bluff_rate(name))
+
+    def close(self):
+        self.flush()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,182 @@
+import argparse
+import importlib
+import json
+import os
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+from perudo_sim import POLICIES, chunk_rng, play_round, split_work, wilson_interval
+
+GAMES_PER_CHUNK = 500
+DEFAULT_DICE = 5
+ELO_START = 1500.0
+ELO_K = 8.0
+
+# Round robin between policies, heads-up. Policies are names from
+# perudo_sim.POLICIES or "module:callable" for your own bots; a policy takes
+# a SeatView and returns an Action, like the ones in perudo_sim.
+# Every pair plays the same number of games in fixed-size chunks spread over
+# a process pool. Chunks are seeded by their place in the schedule, so the
+# results don't depend on the worker count. Custom policies are loaded by
+# name inside the workers, so they don't need to pickle.
+
+def load_policy(spec):
+    if spec in POLICIES:
+        return POLICIES[spec]
+    module_name, _, attribute = spec.partition(":")
+    if not attribute:
+        raise ValueError(f"unknown policy {spec!r}; use one of {', '.join(POLICIES)} or module:callable")
+    return getattr(importlib.import_module(module_name), attribute)
+
+def play_match(policies, dice, rng, starting_seat):
+    # Heads-up game; returns the winning seat and the number of rounds played
+    dice_counts = bytearray((dice, dice))
+    seat = starting_seat
+    rounds = 0
+    while dice_counts[0] and dice_counts[1]:
+        loser = play_round(policies, dice_counts, seat, rng)
+        rounds += 1
+        dice_counts[loser] -= 1
+        seat = loser if dice_counts[loser] else 1 - loser
+    return (0 if dice_counts[0] else 1), rounds
+
+def _play_chunk(first, second, dice, games, seed, chunk_index):
+    # One byte per game, 0 if first won and 1 if second did, and the rounds
+    # each game took. Seats swap every game so neither side always opens.
+    policies = (load_policy(first), load_policy(second))
+    rng = chunk_rng(seed, chunk_index)
+    winners = bytearray(games)
+    rounds = array("H")
+    for game in range(games):
+        swap = game & 1
+        seated = (policies[1], policies[0]) if swap else policies
+        winning_seat, game_rounds = play_match(seated, dice, rng, 0)
+        winners[game] = winning_seat ^ swap
+        rounds.append(game_rounds)
+    return bytes(winners), rounds
+
+class Tournament:
+    def __init__(self, policies):
+        self.policies = list(policies)
+        self.ratings = {policy: ELO_START for policy in self.policies}
+        self.games = {policy: 0 for policy in self.policies}
+        self.wins = {policy: 0 for policy in self.policies}
+        self.rounds = {policy: 0 for policy in self.policies}
+        # head_to_head[a][b] = games a won against b
+        self.head_to_head = {a: {b: 0 for b in self.policies if b != a} for a in self.policies}
+
+    def schedule(self, games):
+        # (first, second, games) for every chunk. Games are shared out evenly
+        # between the pairs and the pairs take turns, so every rating moves
+        # through the whole run rather than one pairing at a time
+        pairs = list(combinations(self.policies, 2))
+        chunk_sizes = [split_work(games // len(pairs) + (1 if i < games % len(pairs) else 0), GAMES_PER_CHUNK)
+                       for i in range(len(pairs))]
+        jobs = []
+        for turn in range(max(map(len, chunk_sizes))):
+            for (first, second), sizes in zip(pairs, chunk_sizes):
+                if turn < len(sizes):
+                    jobs.append((first, second, sizes[turn]))
+        return jobs
+
+    def record(self, first, second, winners, rounds):
+        # Elo is updated game by game in schedule order, so it is reproducible
+        rating_first = self.ratings[first]
+        rating_second = self.ratings[second]
+        for winner in winners:
+            expected = 1.0 / (1.0 + 10 ** ((rating_second - rating_first) / 400))
+            delta = ELO_K * ((1.0 if winner == 0 else 0.0) - expected)
+            rating_first += delta
+            rating_second -= delta
+        self.ratings[first] = rating_first
+        self.ratings[second] = rating_second
+
+        second_wins = sum(winners)
+        first_wins = len(winners) - second_wins
+        total_rounds = sum(rounds)
+        for policy, won, opponent in ((first, first_wins, second), (second, second_wins, first)):
+            self.games[policy] += len(winners)
+            self.wins[policy] += won
+            self.rounds[policy] += total_rounds
+            self.head_to_head[policy][opponent] += won
+
+    def run(self, games, dice=DEFAULT_DICE, seed=0, workers=None, progress=None):
+        chunks = [(first, second, dice, size, seed, i) for i, (first, second, size) in enumerate(self.schedule(games))]
+        workers = workers or os.cpu_count() or 1
+        if workers == 1:
+            for done, chunk in enumerate(chunks, 1):
+                self.record(chunk[0], chunk[1], *_play_chunk(*chunk))
+                if progress:
+                    progress(done, len(chunks))
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_play_chunk, *chunk) for chunk in chunks]
+            # Results go in in schedule order, so ratings match a single worker run
+            for done, (chunk, future) in enumerate(zip(chunks, futures), 1):
+                self.record(chunk[0], chunk[1], *future.result())
+                if progress:
+                    progress(done, len(chunks))
+
+    def standings(self):
+        rows = []
+        for policy in sorted(self.policies, key=lambda policy: -self.ratings[policy]):
+            games = self.games[policy]
+            low, high = wilson_interval(self.wins[policy], games)
+            rows.append({
+                "policy": policy,
+                "elo": self.ratings[policy],
+                "games": games,
+                "wins": self.wins[policy],
+                "win_rate": self.wins[policy] / games if games else 0.0,
+                "win_rate_ci": [low, high],
+                "rounds_per_game": self.rounds[policy] / games if games else 0.0,
+                "head_to_head": {opponent: {"wins": wins, "games": self.pair_games(policy, opponent)}
+                                 for opponent, wins in self.head_to_head[policy].items()},
+            })
+        return rows
+
+    def pair_games(self, a, b):
+        return self.head_to_head[a][b] + self.head_to_head[b][a]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Round robin tournament between Perudo bots")
+    parser.add_argument("--policies", default=",".join(POLICIES),
+                        help="comma separated policies: " + ", ".join(POLICIES) + " or module:callable")
+    parser.add_argument("--games", type=int, default=10000, help="games in the whole round robin")
+    parser.add_argument("--dice", type=int, default=DEFAULT_DICE, help="dice per player")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--json", help="also write the standings to this file")
+    args = parser.parse_args(argv)
+
+    policies = args.policies.split(",")
+    for policy in policies:
+        load_policy(policy)
+    if len(set(policies)) < 2:
+        parser.error("a tournament needs at least two different policies")
+
+    tournament = Tournament(policies)
+    started = time.perf_counter()
+    tournament.run(args.games, args.dice, args.seed, args.workers)
+    elapsed = time.perf_counter() - started
+
+    standings = tournament.standings()
+    print(f"{args.games} games in {elapsed:.1f}s ({args.games / elapsed:.0f} games/s)")
+    for row in standings:
+        low, high = row["win_rate_ci"]
+        print(f"{row['policy']:<12} Elo {row['elo']:7.1f}  {row['wins']:>7}/{row['games']:<7} "
+              f"{row['win_rate']*100:6.2f}% (95% CI {low*100:.2f}-{high*100:.2f}%)  "
+              f"{row['rounds_per_game']:.1f} rounds/game")
+    for row in standings:
+        cells = ", ".join(f"{opponent} {result['wins']}/{result['games']}"
+                          for opponent, result in row["head_to_head"].items())
+        print(f"  {row['policy']} vs {cells}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"games": args.games, "dice": args.dice, "seed": args.seed, "seconds": elapsed,
+                       "standings": standings}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
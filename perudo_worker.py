@@ -0,0 +1,71 @@
+import queue
+import threading
+
+POLL_MS = 15
+
+class BackgroundWorker:
+    # Runs jobs off the Tk thread and hands results back through root.after.
+    # Jobs share a key; submitting again under a key makes older jobs stale,
+    # so they are skipped if not started yet and their results are dropped.
+    # A job without a callback (e.g. warming a cache) just runs.
+    def __init__(self, root, poll_ms=POLL_MS):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.generations = {}
+        self.outstanding = 0
+        self.poll_id = None
+        self.completed = 0
+        self.skipped = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, key, function, args, callback):
+        generation = self.generations.get(key, 0) + 1
+        self.generations[key] = generation
+        self.outstanding += 1
+        self.jobs.put((key, generation, function, args, callback))
+        if self.poll_id is None:
+            self.poll_id = self.root.after(self.poll_ms, self.poll)
+
+    def cancel(self, key):
+        self.generations[key] = self.generations.get(key, 0) + 1
+
+    def is_stale(self, key, generation):
+        return self.generations.get(key) != generation
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            key, generation, function, args, callback = job
+            if self.is_stale(key, generation):
+                self.results.put((key, generation, None, None))
+                continue
+            try:
+                result = function(*args)
+            except Exception as e:
+                result = e
+            self.results.put((key, generation, result, callback))
+
+    def poll(self):
+        self.poll_id = None
+        while True:
+            try:
+                key, generation, result, callback = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.outstanding -= 1
+            if self.is_stale(key, generation):
+                self.skipped += 1
+                continue
+            self.completed += 1
+            if callback is not None:
+                callback(result)
+        if self.outstanding > 0:
+            self.poll_id = self.root.after(self.poll_ms, self.poll)
+
+    def shutdown(self):
+        self.jobs.put(None)